@@ -1,41 +1,58 @@
 """
 Ephemeral Workout Analyzer API
 A stateless FastAPI backend for serverless deployment.
-Zero data persistence - all processing happens in RAM.
+Zero disk persistence - all processing happens in RAM.
 """
 
 import io
 import os
+import csv
+import asyncio
+import time
 import hashlib
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, Header
+import functools
+import multiprocessing
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import MappingProxyType
+from typing import TYPE_CHECKING, List, Dict, Any, Mapping, Optional, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, Header, Security
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-# Import core logic from the main app
+# Core logic lives in the main app (app.py). It pulls in Streamlit and pandas,
+# so it is imported lazily by the analysis pipeline rather than here; the
+# trivial endpoints then cold-start without loading either.
 import sys
-sys.path.append('.')
-
-from app import (
-    parse_plan_text,
-    process_fit_laps,
-    extract_session_info,
-    group_laps_by_planned,
-    calculate_overall_summary,
-    generate_detailed_output
-)
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+if API_DIR not in sys.path:
+    sys.path.append(API_DIR)
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Rate limiter setup
 limiter = Limiter(key_func=get_remote_address)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Shut the pipeline worker processes down with the server."""
+    yield
+    shutdown_process_pool()
+
+
 app = FastAPI(
     title="Ephemeral Workout Analyzer",
-    description="Zero-knowledge workout analysis. No data stored.",
-    version="1.0.0"
+    description="Zero-knowledge workout analysis. No data written to disk.",
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add rate limit handler
@@ -56,18 +73,24 @@ app.add_middleware(
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 # Tiered API keys (demo - in production use secure storage)
-API_KEYS = {
+# Frozen so the shared tier info handed to every request cannot be mutated
+API_KEYS = MappingProxyType({
     # Format: "key": {"tier": "free|pro|elite", "rate_limit": "X/day"}
-    "demo-free-key": {"tier": "free", "daily_limit": 3},
-    "demo-pro-key": {"tier": "pro", "daily_limit": 50},
-    "demo-elite-key": {"tier": "elite", "daily_limit": 1000},
-}
+    "demo-free-key": MappingProxyType({"tier": "free", "daily_limit": 3}),
+    "demo-pro-key": MappingProxyType({"tier": "pro", "daily_limit": 50}),
+    "demo-elite-key": MappingProxyType({"tier": "elite", "daily_limit": 1000}),
+})
+ANONYMOUS_TIER = MappingProxyType({"tier": "anonymous", "daily_limit": 3})
 
 
-async def get_api_key(api_key: Optional[str] = Depends(API_KEY_HEADER)) -> Optional[dict]:
-    """Validate API key and return tier info."""
+async def get_api_key(api_key: Optional[str] = Security(API_KEY_HEADER)) -> Mapping[str, Any]:
+    """Validate API key and return tier info.
+    
+    Kept async: FastAPI runs sync dependencies in a threadpool, which would
+    cost more than this lookup itself.
+    """
     if api_key is None:
-        return {"tier": "anonymous", "daily_limit": 3}
+        return ANONYMOUS_TIER
     
     key_info = API_KEYS.get(api_key)
     if key_info is None:
@@ -77,6 +100,31 @@ async def get_api_key(api_key: Optional[str] = Depends(API_KEY_HEADER)) -> Optio
 
 
 
+# Upload limits (50MB for serverless, read in 1MB chunks)
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def read_upload_capped(upload: UploadFile, cap: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload, rejecting it as soon as it exceeds the cap.
+    
+    Oversize files are refused before the whole body is held in RAM. When the
+    multipart parser already knows the size, the file is checked up front and
+    read in one exact-size allocation instead of a growing buffer.
+    """
+    if upload.size is not None:
+        if upload.size > cap:
+            raise HTTPException(status_code=413, detail="File too large. Maximum 50MB.")
+        return await upload.read()
+    
+    buf = io.BytesIO()
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        if buf.tell() + len(chunk) > cap:
+            raise HTTPException(status_code=413, detail="File too large. Maximum 50MB.")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
 class AnalysisResponse(BaseModel):
     success: bool
     sport: str
@@ -86,10 +134,27 @@ class AnalysisResponse(BaseModel):
     error: Optional[str] = None
 
 
+# Session fields copied to friendlier names: (fit_name, new_name, transform or None)
+SESSION_FIELD_MAP = (
+    ('total_ascent', 'elevation_gain', None),
+    ('enhanced_avg_speed', 'avg_speed_ms', None),
+    ('avg_running_cadence', 'avg_cadence', None),
+    ('avg_fractional_cadence', 'fractional_cadence', None),
+    ('avg_stance_time', 'avg_gct', None),
+    ('avg_stride_length', 'avg_stride', lambda v: round(v / 1000, 2)),  # mm to m
+    ('left_right_balance', 'left_balance', lambda v: round(v / 128 * 100, 1)),  # Convert to percentage
+    ('normalized_power', 'normalized_power', None),
+    ('training_stress_score', 'tss', None),
+    ('total_training_effect', 'training_effect', None),
+)
+
+
 def parse_fit_bytes(fit_bytes: bytes) -> tuple:
     """Parse FIT file from bytes using TRUE in-memory processing.
     
     Uses fitdecode which supports BytesIO - zero disk trace.
+    CRC checking is disabled: fitdecode only warns on a bad CRC by default,
+    so verifying every chunk costs time without changing the result.
     """
     import fitdecode
     
@@ -98,46 +163,30 @@ def parse_fit_bytes(fit_bytes: bytes) -> tuple:
     session_info = {}
     laps = []
     
-    with fitdecode.FitReader(mem_file) as fit:
+    with fitdecode.FitReader(mem_file, check_crc=fitdecode.CrcCheck.DISABLED) as fit:
         for frame in fit:
             if not isinstance(frame, fitdecode.FitDataMessage):
                 continue
             
-            if frame.name == 'session':
-                for field in frame.fields:
-                    session_info[field.name] = field.value
+            # Records are by far the most common frame and are not needed here
+            name = frame.name
+            if name == 'record':
+                continue
+            
+            if name == 'session':
+                session_info.update({field.name: field.value for field in frame.fields})
                     
                 # Extract specific enhanced fields
-                field_map = {
-                    'total_ascent': 'elevation_gain',
-                    'enhanced_avg_speed': 'avg_speed_ms',
-                    'avg_running_cadence': 'avg_cadence',
-                    'avg_fractional_cadence': 'fractional_cadence',
-                    'avg_stance_time': 'avg_gct',
-                    'avg_stride_length': 'avg_stride',
-                    'left_right_balance': 'left_balance',
-                    'normalized_power': 'normalized_power',
-                    'training_stress_score': 'tss',
-                    'total_training_effect': 'training_effect',
-                }
-                for old_name, new_name in field_map.items():
-                    if old_name in session_info and session_info[old_name] is not None:
-                        value = session_info[old_name]
-                        if new_name == 'avg_stride' and value:
-                            session_info[new_name] = round(value / 1000, 2)  # mm to m
-                        elif new_name == 'left_balance' and value:
-                            session_info[new_name] = round(value / 128 * 100, 1)  # Convert to percentage
-                        else:
-                            session_info[new_name] = value
+                for old_name, new_name, transform in SESSION_FIELD_MAP:
+                    value = session_info.get(old_name)
+                    if value is not None:
+                        session_info[new_name] = transform(value) if transform and value else value
             
-            elif frame.name == 'lap':
-                lap_data = {}
-                for field in frame.fields:
-                    lap_data[field.name] = field.value
-                laps.append(lap_data)
+            elif name == 'lap':
+                laps.append({field.name: field.value for field in frame.fields})
             
             # Extract VO2 Max from developer fields
-            elif frame.name == 'unknown_140':
+            elif name == 'unknown_140':
                 for field in frame.fields:
                     if field.name == 'unknown_29' and field.value is not None:
                         session_info['vo2_max'] = round(field.value / 18724.7, 2)
@@ -145,21 +194,60 @@ def parse_fit_bytes(fit_bytes: bytes) -> tuple:
     return laps, session_info
 
 
+def _parse_time_column(times: "pd.Series") -> "pd.Series":
+    """Vectorized FORM time parsing (M:SS.xx or H:MM:SS.xx) to seconds."""
+    import pandas as pd
+    
+    # Split at most twice so one malformed cell cannot widen every row;
+    # rows that are not M:SS or H:MM:SS become 0 on their own
+    colons = times.str.count(':')
+    parts = times.str.split(':', n=2, expand=True)
+    if parts.shape[1] < 2:
+        return pd.Series(0.0, index=times.index)
+    values = [pd.to_numeric(parts[i], errors='coerce') for i in parts.columns]
+    seconds = values[0] * 60 + values[1]
+    if len(values) == 3:
+        # Only rows with an hours component have a third part
+        seconds = seconds.where(colons != 2, seconds * 60 + values[2])
+    return seconds.where(colons.isin((1, 2))).fillna(0.0)
+
+
+def _form_text_column(df: "pd.DataFrame", name: str, default: str = '') -> "pd.Series":
+    """Stripped text column, or `default` on every row if the export lacks it."""
+    import pandas as pd
+    
+    if name in df.columns:
+        return df[name].fillna('').str.strip()
+    return pd.Series(default, index=df.index)
+
+
+def _form_numeric_column(df: "pd.DataFrame", name: str, dtype=int) -> "pd.Series":
+    """Numeric column with blanks as 0, or all zeros if the export lacks it."""
+    import pandas as pd
+    
+    if name not in df.columns:
+        return pd.Series(0, index=df.index, dtype=dtype)
+    return pd.to_numeric(df[name], errors='coerce').fillna(0).astype(dtype)
+
+
 def parse_form_csv_bytes(csv_bytes: bytes) -> tuple:
     """Parse FORM goggles CSV from bytes.
     
     Returns processed laps and session data ready for use.
+    The data section is parsed column-wise with pandas.
     """
+    import numpy as np
+    import pandas as pd
+    
     try:
-        content = csv_bytes.decode('utf-8')
-        lines = content.strip().split('\n')
+        text = io.StringIO(csv_bytes.decode('utf-8').strip())
+        reader = csv.reader(text)
         
-        # Parse header section (first 2 rows)
+        # Parse header section (first 2 rows); csv handles quoted commas
         session_info = {}
-        if len(lines) >= 2:
-            header_keys = lines[0].split(',')
-            header_values = lines[1].split(',')
-            
+        header_keys = next(reader, None)
+        header_values = next(reader, None)
+        if header_values is not None:
             for key, value in zip(header_keys, header_values):
                 key = key.strip()
                 value = value.strip()
@@ -171,126 +259,328 @@ def parse_form_csv_bytes(csv_bytes: bytes) -> tuple:
             session_info['pool_length'] = int(session_info.get('Pool Size', 25))
             session_info['start_time'] = f"{session_info.get('Swim Date', '')} {session_info.get('Swim Start Time', '')}"
         
-        # Parse data section (row 4 onwards)
-        lengths = []
-        if len(lines) >= 5:
-            data_header = lines[3].split(',')
-            col_map = {col.strip(): i for i, col in enumerate(data_header)}
-            
-            for row_idx in range(4, len(lines)):
-                row = lines[row_idx].strip()
-                if not row:
-                    continue
-                
-                values = row.split(',')
-                if len(values) < len(data_header):
-                    continue
-                
-                def get_val(col_name, default=''):
-                    idx = col_map.get(col_name)
-                    if idx is not None and idx < len(values):
-                        return values[idx].strip()
-                    return default
-                
-                def parse_time(time_str):
-                    if not time_str or time_str == '0:00.00':
-                        return 0.0
-                    parts = time_str.split(':')
-                    if len(parts) == 2:
-                        return float(parts[0]) * 60 + float(parts[1])
-                    return 0.0
-                
-                stroke = get_val('Strk', 'REST')
-                is_rest = stroke == 'REST' or get_val('Length (m)', '0') == '0'
-                
-                lengths.append({
-                    'set_number': int(get_val('Set #', '0') or 0),
-                    'set_description': get_val('Set', ''),
-                    'distance_m': int(get_val('Length (m)', '0') or 0),
-                    'stroke_type': stroke,
-                    'move_time': parse_time(get_val('Move Time', '0:00.00')),
-                    'rest_time': parse_time(get_val('Rest Time', '0:00.00')),
-                    'avg_hr': int(get_val('Avg BPM (moving)', '0') or 0) or None,
-                    'max_hr': int(get_val('Max BPM', '0') or 0) or None,
-                    'swolf': int(get_val('SWOLF', '0') or 0),
-                    'stroke_rate': int(get_val('Avg Strk Rate (strk/min)', '0') or 0),
-                    'stroke_count': int(get_val('Strk Count', '0') or 0),
-                    'dps': float(get_val('Avg DPS', '0') or 0),
-                    'calories': int(get_val('Calories', '0') or 0),
-                    'is_rest': is_rest,
-                })
-        
-        # Group lengths by set and combine
-        processed_laps = []
-        current_set = None
-        current_laps = []
-        pool_length = session_info.get('pool_length', 25)
+        # Parse data section (row 4 onwards, row 3 is the header), continuing
+        # from the same buffer so the text is never split into a list of lines.
+        # Numeric columns are converted by the C parser; only text columns stay str.
+        next(text, None)
+        data_start = text.tell()
+        rows = csv.reader(text)
+        num_columns = len(next(rows, []))
+        # Field count of each data row, skipping the blank lines pandas skips too
+        row_widths = np.array([len(row) for row in rows if len(row) > 1 or (row and row[0].strip())])
+        text.seek(data_start)
+        try:
+            # index_col=False and usecols stop a row with extra trailing fields
+            # (e.g. a trailing comma) from shifting every column into the index
+            df = pd.read_csv(
+                text, skipinitialspace=True, index_col=False, usecols=range(num_columns),
+                dtype={'Set': str, 'Strk': str, 'Move Time': str, 'Rest Time': str},
+            )
+        except pd.errors.EmptyDataError:
+            return [], session_info
+        # Rows with fewer fields than the header are truncated lengths; skip them
+        complete = row_widths >= num_columns
+        if not complete.all():
+            df = df[complete].reset_index(drop=True)
+        if df.empty:
+            return [], session_info
+        df.columns = df.columns.str.strip()
+        col = functools.partial(_form_text_column, df)
+        num = functools.partial(_form_numeric_column, df)
         
-        for length in lengths:
-            set_desc = length['set_description']
-            if set_desc != current_set and current_laps:
-                combined = _combine_form_laps(current_laps, pool_length)
-                if combined:
-                    processed_laps.append(combined)
-                current_laps = []
-            current_set = set_desc
-            current_laps.append(length)
+        stroke = col('Strk', 'REST').to_numpy()
+        set_desc = col('Set').to_numpy()
+        # Only an explicit zero length marks rest; a blank length still counts as a length
+        if 'Length (m)' in df.columns:
+            length = pd.to_numeric(df['Length (m)'], errors='coerce')
+        else:
+            length = pd.Series(0, index=df.index)
+        distance = length.fillna(0).astype(int).to_numpy()
+        active = ~((stroke == 'REST') | (length == 0).to_numpy())
         
-        if current_laps:
-            combined = _combine_form_laps(current_laps, pool_length)
-            if combined:
-                processed_laps.append(combined)
+        # Consecutive lengths with the same set description form one set
+        starts = np.flatnonzero(np.r_[True, set_desc[1:] != set_desc[:-1]])
+        sets = _reduce_form_sets(
+            starts, active, distance,
+            _parse_time_column(col('Move Time')).to_numpy(),
+            _parse_time_column(col('Rest Time')).to_numpy(),
+            num('Avg BPM (moving)').to_numpy(),
+            num('Max BPM').to_numpy(),
+            num('SWOLF').to_numpy(),
+            num('Strk Count').to_numpy(),
+            num('Calories').to_numpy(),
+        )
         
+        set_numbers = num('Set #').to_numpy()[starts].tolist()
+        processed_laps = [
+            _combine_form_laps(set_number, set_desc[i], stroke[i], *totals)
+            for set_number, i, *totals in zip(set_numbers, starts.tolist(), *(a.tolist() for a in sets))
+        ]
         return processed_laps, session_info
     
     except Exception:
         return None, None
 
 
-def _combine_form_laps(lengths: list, pool_length: int) -> dict:
-    """Combine multiple FORM lengths into a single lap."""
-    if not lengths:
-        return None
+def _reduce_form_sets(starts, active, dist, move, rest, hr, max_hr, swolf, strokes, calories) -> tuple:
+    """Reduce per-length columns to per-set totals in one pass per column.
     
-    active = [l for l in lengths if not l['is_rest']]
+    `starts` holds the index of the first length of each set. HR, max HR,
+    SWOLF and strokes only count active lengths with a non-zero reading.
+    """
+    import numpy as np
     
-    total_dist = sum(l['distance_m'] for l in lengths)
-    total_move = sum(l['move_time'] for l in lengths)
-    total_rest = sum(l['rest_time'] for l in lengths)
+    hr = np.where(active & (hr > 0), hr, 0)
+    max_hr = np.where(active & (max_hr > 0), max_hr, 0)
+    swolf = np.where(active & (swolf > 0), swolf, 0)
+    strokes = np.where(active, strokes, 0)
     
-    hr_vals = [l['avg_hr'] for l in active if l['avg_hr']]
-    max_hr_vals = [l['max_hr'] for l in active if l['max_hr']]
-    swolf_vals = [l['swolf'] for l in active if l['swolf']]
+    def total(values):
+        return np.add.reduceat(values, starts)
     
+    return (
+        total(dist), total(move), total(rest),
+        total(hr), total(hr > 0), np.maximum.reduceat(max_hr, starts),
+        total(swolf), total(swolf > 0),
+        total(strokes), total(active), total(calories),
+    )
+
+
+def _combine_form_laps(set_number, set_description, stroke, total_dist, total_move, total_rest,
+                       hr_sum, hr_count, max_hr, swolf_sum, swolf_count,
+                       total_strokes, num_lengths, calories) -> dict:
+    """Build a single lap from the reduced FORM lengths of one set."""
     avg_speed = total_dist / total_move if total_move > 0 else 0
     pace_sec = 100 / avg_speed if avg_speed > 0 else 0
     
     return {
-        'lap_number': lengths[0]['set_number'],
-        'set_description': lengths[0]['set_description'],
+        'lap_number': set_number,
+        'set_description': set_description,
         'duration_seconds': total_move + total_rest,
         'distance_m': total_dist,
         'avg_speed_ms': avg_speed,
         'swim_pace': f"{int(pace_sec // 60)}:{int(pace_sec % 60):02d}" if pace_sec else '--:--',
-        'avg_hr': int(sum(hr_vals) / len(hr_vals)) if hr_vals else None,
-        'max_hr': max(max_hr_vals) if max_hr_vals else None,
-        'swolf': int(sum(swolf_vals) / len(swolf_vals)) if swolf_vals else None,
-        'total_strokes': sum(l['stroke_count'] for l in active),
-        'swim_stroke': lengths[0].get('stroke_type', 'FR'),
-        'num_lengths': len(active),
-        'calories': sum(l['calories'] for l in lengths),
+        'avg_hr': int(hr_sum / hr_count) if hr_count else None,
+        'max_hr': max_hr or None,
+        'swolf': int(swolf_sum / swolf_count) if swolf_count else None,
+        'total_strokes': total_strokes,
+        'swim_stroke': stroke,
+        'num_lengths': num_lengths,
+        'calories': calories,
         'is_rest': total_dist == 0,
         'source': 'FORM',
     }
 
 
+def is_fit_file(file_bytes: bytes) -> bool:
+    """Check for the '.FIT' signature at bytes 8-11 of the FIT file header."""
+    return len(file_bytes) >= 12 and memoryview(file_bytes)[8:12] == b'.FIT'
+
+
+def is_form_csv(file_bytes: bytes, file_name: str) -> bool:
+    """CSVs have no magic number, so fall back to the suffix for non-FIT files."""
+    return not is_fit_file(file_bytes) and file_name.endswith('.csv')
+
+
+class WorkoutParseError(ValueError):
+    """Raised by the pipeline when the uploaded file cannot be parsed."""
+
+
+# Planned entry shared by every lap of a workout analyzed without a plan
+UNPLANNED_LAP = {'type': 'LAP', 'duration_seconds': 0, 'target_distance_m': 0}
+
+
+def run_analysis_pipeline(file_bytes: bytes, file_name: str, plan: Optional[str]) -> Dict[str, Any]:
+    """Parse, summarize and report on a workout file.
+    
+    Runs in a worker process, so it only takes and returns picklable data.
+    """
+    from app import (
+        parse_plan_text,
+        process_fit_laps,
+        extract_session_info,
+        group_laps_by_planned,
+        calculate_overall_summary,
+        generate_detailed_output
+    )
+    
+    # Detect file type (FIT header signature first) and parse accordingly
+    if is_form_csv(file_bytes, file_name):
+        # FORM goggles CSV
+        raw_laps, session_data = parse_form_csv_bytes(file_bytes)
+        if not raw_laps:
+            raise WorkoutParseError("Could not parse FORM CSV file.")
+        sport = 'swimming'
+        processed_laps = raw_laps  # Already processed by parse_form_csv_bytes
+    else:
+        # FIT file
+        raw_laps, session_info = parse_fit_bytes(file_bytes)
+        if not raw_laps:
+            raise WorkoutParseError("Could not parse FIT file.")
+        
+        session_data = extract_session_info(session_info)
+        sport = session_data['sport']
+        processed_laps = process_fit_laps(raw_laps, sport=sport, min_duration=3)
+    
+    summary = calculate_overall_summary(processed_laps, session_data)
+    
+    # Check if plan was provided and is valid
+    has_plan = False
+    planned_blocks = []
+    num_rounds = 0
+    
+    if plan and plan.strip():
+        planned_blocks, num_rounds = parse_plan_text(plan)
+        has_plan = bool(planned_blocks)
+    
+    if has_plan:
+        # Compare against planned workout
+        grouped = group_laps_by_planned(planned_blocks, processed_laps, sport=sport)
+        markdown_report = generate_detailed_output(
+            planned_blocks, num_rounds, grouped, summary, session_data
+        )
+    else:
+        # No plan - just report actual laps
+        grouped = [
+            {
+                'planned': {**UNPLANNED_LAP, 'label': lap.get('set_description') or f"Lap {i+1}"},
+                'combined': lap,
+                'actual_laps': [lap]
+            }
+            for i, lap in enumerate(processed_laps)
+        ]
+        
+        # Generate simple lap-based report
+        markdown_report = _generate_simple_report(summary, grouped, session_data)
+    
+    return {
+        'success': True,
+        'sport': sport,
+        'summary': summary,
+        'grouped_data': grouped,
+        'markdown_report': markdown_report,
+    }
+
+
+# Worker processes for the CPU-bound pipeline (created on first use)
+PIPELINE_WORKERS = os.cpu_count() or 1
+_process_pool: Optional[ProcessPoolExecutor] = None
+# Bound in-flight jobs so queued uploads cannot pile up in memory
+_pipeline_slots = asyncio.Semaphore(PIPELINE_WORKERS * 2)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared pipeline process pool, creating it if needed.
+    
+    Workers are started from a clean forkserver (spawn where unavailable)
+    rather than forked from the server, which already runs threads.
+    """
+    global _process_pool
+    if _process_pool is None:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        _process_pool = ProcessPoolExecutor(max_workers=PIPELINE_WORKERS, mp_context=context)
+    return _process_pool
+
+
+def shutdown_process_pool(pool: Optional[ProcessPoolExecutor] = None) -> None:
+    """Shut the pipeline pool down; the next job creates a fresh one.
+    
+    If `pool` is given, it is only discarded while it is still the current
+    pool, so a job that saw an old pool break cannot shut down its replacement.
+    """
+    global _process_pool
+    if _process_pool is not None and (pool is None or _process_pool is pool):
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+async def run_pipeline_job(file_bytes: bytes, file_name: str, plan: Optional[str]) -> Dict[str, Any]:
+    """Run the pipeline in a worker process, replacing the pool if a worker died.
+    
+    A killed worker (e.g. by the OOM killer) breaks the whole pool, so it is
+    discarded and the job is retried once on a new pool before giving up.
+    """
+    loop = asyncio.get_running_loop()
+    async with _pipeline_slots:
+        for _ in range(2):
+            pool = get_process_pool()
+            try:
+                return await loop.run_in_executor(
+                    pool, run_analysis_pipeline, file_bytes, file_name, plan
+                )
+            except BrokenProcessPool:
+                shutdown_process_pool(pool)
+    raise HTTPException(status_code=503, detail="Analysis workers unavailable. Please retry.")
+
+
+# Recent rendered results keyed by content hash so client retries skip the pipeline.
+# Held in RAM only, for a few minutes and within a byte budget, then dropped.
+RESULT_CACHE_TTL_SECONDS = 5 * 60
+RESULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Entries are (stored at, rendered JSON) in insertion order, so the oldest come first
+_result_cache: "OrderedDict[bytes, Tuple[float, bytes]]" = OrderedDict()
+_result_cache_bytes = 0
+
+
+def _evict_result(key: bytes) -> None:
+    """Drop one cached result and release its bytes from the budget."""
+    global _result_cache_bytes
+    _, content = _result_cache.pop(key)
+    _result_cache_bytes -= len(content)
+
+
+def get_cached_result(key: bytes) -> Optional[bytes]:
+    """Return a cached rendered result, evicting entries older than the TTL first."""
+    expired_before = time.monotonic() - RESULT_CACHE_TTL_SECONDS
+    while _result_cache:
+        oldest_key, (stored_at, _) = next(iter(_result_cache.items()))
+        if stored_at > expired_before:
+            break
+        _evict_result(oldest_key)
+    entry = _result_cache.get(key)
+    return entry[1] if entry else None
+
+
+def store_cached_result(key: bytes, content: bytes) -> None:
+    """Cache a rendered result, evicting the oldest entries to stay within the byte budget."""
+    global _result_cache_bytes
+    if key in _result_cache:
+        _evict_result(key)
+    if len(content) > RESULT_CACHE_MAX_BYTES:
+        return
+    while _result_cache_bytes + len(content) > RESULT_CACHE_MAX_BYTES:
+        _evict_result(next(iter(_result_cache)))
+    _result_cache[key] = (time.monotonic(), content)
+    _result_cache_bytes += len(content)
+
+
+def render_analysis(result: Dict[str, Any]) -> bytes:
+    """Validate a pipeline result and serialize it straight to JSON bytes.
+    
+    Uses Pydantic's Rust serializer once, instead of FastAPI validating the
+    returned model a second time before encoding it.
+    """
+    return AnalysisResponse(**result).model_dump_json().encode('utf-8')
+
+
+def result_cache_key(file_bytes: bytes, file_name: str, plan: Optional[str]) -> bytes:
+    """Build the result cache key from the file type, file bytes and plan text."""
+    kind = b'csv' if is_form_csv(file_bytes, file_name) else b'fit'
+    return (
+        kind
+        + hashlib.sha256(file_bytes).digest()
+        + hashlib.sha256((plan or '').encode('utf-8')).digest()
+    )
+
+
 @app.post("/analyze", response_model=AnalysisResponse)
 @limiter.limit("10/minute")
 async def analyze_workout(
     request: Request,
     file: UploadFile = File(..., description="FIT or FORM CSV file to analyze"),
     plan: Optional[str] = Form(None, description="Workout plan text from intervals.icu (optional)"),
-    key_info: dict = Depends(get_api_key)
+    key_info: Mapping[str, Any] = Depends(get_api_key)
 ):
     """
     Analyze a workout file, optionally comparing against a planned workout.
@@ -299,7 +589,9 @@ async def analyze_workout(
     - Garmin/Wahoo FIT files
     - FORM goggles CSV exports
     
-    All processing is ephemeral - nothing is stored on the server.
+    All processing happens in RAM and nothing is written to disk. The rendered
+    result is kept in memory for a few minutes so retries of the same upload
+    are answered without re-running the analysis, then discarded.
     
     Rate limits:
     - Anonymous: 3 requests/day
@@ -309,75 +601,31 @@ async def analyze_workout(
     """
 
     try:
-        # Read file bytes into memory
-        file_bytes = await file.read()
+        # Read file bytes into memory (size limit enforced while reading)
+        file_bytes = await read_upload_capped(file)
         file_name = file.filename.lower() if file.filename else ''
         
-        # Validate file size (50MB limit for serverless)
-        if len(file_bytes) > 50 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="File too large. Maximum 50MB.")
-        
-        # Detect file type and parse accordingly
-        if file_name.endswith('.csv'):
-            # FORM goggles CSV
-            raw_laps, session_data = parse_form_csv_bytes(file_bytes)
-            if not raw_laps:
-                raise HTTPException(status_code=400, detail="Could not parse FORM CSV file.")
-            sport = 'swimming'
-            processed_laps = raw_laps  # Already processed by parse_form_csv_bytes
-        else:
-            # FIT file
-            raw_laps, session_info = parse_fit_bytes(file_bytes)
-            if not raw_laps:
-                raise HTTPException(status_code=400, detail="Could not parse FIT file.")
-            
-            session_data = extract_session_info(session_info)
-            sport = session_data['sport']
-            processed_laps = process_fit_laps(raw_laps, sport=sport, min_duration=3)
-        
-        summary = calculate_overall_summary(processed_laps, session_data)
+        # Serve retries of the same upload from the cache. "Cache-Control: no-cache"
+        # or "no-store" opts out of both the lookup and keeping this result.
+        cache_control = request.headers.get('cache-control', '')
+        use_cache = 'no-cache' not in cache_control and 'no-store' not in cache_control
+        if use_cache:
+            cache_key = await asyncio.to_thread(result_cache_key, file_bytes, file_name, plan)
+            cached = get_cached_result(cache_key)
+            if cached is not None:
+                return Response(content=cached, media_type="application/json")
         
-        # Check if plan was provided and is valid
-        has_plan = False
-        planned_blocks = []
-        num_rounds = 0
+        # Run the CPU-bound pipeline in a worker process to escape the GIL
+        result = await run_pipeline_job(file_bytes, file_name, plan)
         
-        if plan and plan.strip():
-            planned_blocks, num_rounds = parse_plan_text(plan)
-            has_plan = bool(planned_blocks)
+        content = render_analysis(result)
+        if use_cache:
+            store_cached_result(cache_key, content)
         
-        if has_plan:
-            # Compare against planned workout
-            grouped = group_laps_by_planned(planned_blocks, processed_laps, sport=sport)
-            markdown_report = generate_detailed_output(
-                planned_blocks, num_rounds, grouped, summary, session_data
-            )
-        else:
-            # No plan - just report actual laps
-            grouped = []
-            for i, lap in enumerate(processed_laps):
-                grouped.append({
-                    'planned': {
-                        'type': 'LAP',
-                        'duration_seconds': 0,
-                        'target_distance_m': 0,
-                        'label': lap.get('set_description') or f"Lap {i+1}"
-                    },
-                    'combined': lap,
-                    'actual_laps': [lap]
-                })
-            
-            # Generate simple lap-based report
-            markdown_report = _generate_simple_report(summary, grouped, session_data)
-        
-        return AnalysisResponse(
-            success=True,
-            sport=sport,
-            summary=summary,
-            grouped_data=grouped,
-            markdown_report=markdown_report
-        )
+        return Response(content=content, media_type="application/json")
         
+    except WorkoutParseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -392,102 +640,77 @@ async def analyze_workout(
         )
 
 
+# Display names for FORM stroke codes
+STROKE_NAMES = {'FR': 'Free', 'BR': 'Breast', 'BA': 'Back', 'FL': 'Fly'}
+
+
 def _generate_simple_report(summary: Dict, grouped_data: List[Dict], session_data: Dict) -> str:
     """Generate a markdown report for workouts without a plan."""
-    output = []
+    buf = io.StringIO()
+    write = buf.write
     
     sport = session_data.get('sport', 'unknown').upper()
     activity_name = session_data.get('activity_name', 'Activity')
     emoji = "🏊" if sport.lower() == 'swimming' else ("🚴" if sport.lower() == 'cycling' else "🏃")
     
-    output.append(f"# {emoji} {sport}: {activity_name}")
-    output.append("")
+    write(f"# {emoji} {sport}: {activity_name}\n\n")
     
     start_time = session_data.get('start_time')
     if start_time:
-        output.append(f"**Date:** {start_time}")
-    output.append("")
+        write(f"**Date:** {start_time}\n")
+    write("\n")
 
     # Summary Table
-    output.append("## 📊 Summary")
-    output.append("| Metric | Value |")
-    output.append("|--------|-------|")
-    output.append(f"| **Duration** | {summary.get('total_duration', '—')} |")
-    output.append(f"| **Distance** | {summary.get('total_distance', '—')} |")
+    write("## 📊 Summary\n"
+          "| Metric | Value |\n"
+          "|--------|-------|\n"
+          f"| **Duration** | {summary.get('total_duration', '—')} |\n"
+          f"| **Distance** | {summary.get('total_distance', '—')} |\n")
     if summary.get('avg_hr'):
-        output.append(f"| **Avg HR** | {summary['avg_hr']} bpm |")
+        write(f"| **Avg HR** | {summary['avg_hr']} bpm |\n")
     if summary.get('max_hr'):
-        output.append(f"| **Max HR** | {summary['max_hr']} bpm |")
+        write(f"| **Max HR** | {summary['max_hr']} bpm |\n")
     if summary.get('avg_power'):
-        output.append(f"| **Avg Power** | {summary['avg_power']} W |")
+        write(f"| **Avg Power** | {summary['avg_power']} W |\n")
     if summary.get('calories'):
-        output.append(f"| **Calories** | {summary['calories']} kcal |")
-    output.append("")
+        write(f"| **Calories** | {summary['calories']} kcal |\n")
+    write("\n")
 
     # Laps/Sets section
     sport = session_data.get('sport', 'running')
+    is_swimming = sport == 'swimming'
+    write("## 🔄 Sets\n\n" if is_swimming else "## 🔄 Laps\n\n")
     
-    if sport == 'swimming':
-        output.append("## 🔄 Sets")
-    else:
-        output.append("## 🔄 Laps")
-    output.append("")
-    
-    if grouped_data:
-        for i, g in enumerate(grouped_data, 1):
-            lap = g.get('combined')
-            if not lap:
-                continue
-            
-            # Format duration
-            dur_sec = lap.get('duration_seconds', 0)
-            mins, secs = divmod(int(dur_sec), 60)
-            duration = f"{mins}:{secs:02d}"
-            
-            # Format distance
+    for i, g in enumerate(grouped_data, 1):
+        lap = g.get('combined')
+        if not lap:
+            continue
+        
+        # Format duration
+        mins, secs = divmod(int(lap.get('duration_seconds', 0)), 60)
+        duration = f"{mins}:{secs:02d}"
+        
+        # One line per lap: optional metrics are inlined as " | ..." fragments
+        if is_swimming:
             dist_m = lap.get('distance_m', 0)
-            if dist_m >= 1000:
-                distance = f"{dist_m/1000:.2f}km"
-            else:
-                distance = f"{int(dist_m)}m"
-            
-            # Build inline format
-            parts = []
-            
-            if sport == 'swimming':
-                set_desc = lap.get('set_description') or f"Set {i}"
-                pace = lap.get('swim_pace') or '--:--'
-                parts.append(f"**{distance}** in {duration}")
-                parts.append(f"Pace {pace}/100m")
-                
-                if lap.get('avg_hr'):
-                    parts.append(f"HR {lap['avg_hr']} avg")
-                if lap.get('swolf'):
-                    parts.append(f"SWOLF {lap['swolf']}")
-                if lap.get('total_strokes'):
-                    parts.append(f"Strokes {lap['total_strokes']}")
-                if lap.get('dps'):
-                    parts.append(f"DPS {lap['dps']:.2f}")
-                if lap.get('swim_stroke') and lap['swim_stroke'] != 'REST':
-                    stroke_name = {'FR': 'Free', 'BR': 'Breast', 'BA': 'Back', 'FL': 'Fly'}.get(lap['swim_stroke'], lap['swim_stroke'])
-                    parts.append(f"({stroke_name})")
-                
-                output.append(f"**{set_desc}:** " + " | ".join(parts) + "  ")
-            else:
-                pace = lap.get('avg_pace') or '--:--'
-                parts.append(f"**{duration}** — {pace}/km")
-                if lap.get('avg_hr'):
-                    parts.append(f"HR {lap['avg_hr']}")
-                if lap.get('cadence'):
-                    parts.append(f"Cad {lap['cadence']} spm")
-                output.append(f"**Lap {i}:** " + " | ".join(parts) + "  ")
-            
-            output.append("")
+            distance = f"{dist_m/1000:.2f}km" if dist_m >= 1000 else f"{int(dist_m)}m"
+            hr = f" | HR {lap['avg_hr']} avg" if lap.get('avg_hr') else ""
+            swolf = f" | SWOLF {lap['swolf']}" if lap.get('swolf') else ""
+            strokes = f" | Strokes {lap['total_strokes']}" if lap.get('total_strokes') else ""
+            dps = f" | DPS {lap['dps']:.2f}" if lap.get('dps') else ""
+            stroke = lap.get('swim_stroke')
+            stroke = f" | ({STROKE_NAMES.get(stroke, stroke)})" if stroke and stroke != 'REST' else ""
+            write(f"**{lap.get('set_description') or f'Set {i}'}:** **{distance}** in {duration}"
+                  f" | Pace {lap.get('swim_pace') or '--:--'}/100m{hr}{swolf}{strokes}{dps}{stroke}  \n\n")
+        else:
+            hr = f" | HR {lap['avg_hr']}" if lap.get('avg_hr') else ""
+            cadence = f" | Cad {lap['cadence']} spm" if lap.get('cadence') else ""
+            write(f"**Lap {i}:** **{duration}** — {lap.get('avg_pace') or '--:--'}/km{hr}{cadence}  \n\n")
     
-    output.append("---")
-    output.append("*Report generated without a workout plan - lap data only.*")
+    write("---\n"
+          "*Report generated without a workout plan - lap data only.*")
             
-    return "\n".join(output)
+    return buf.getvalue()
 
 
 
@@ -498,7 +721,7 @@ async def health_check():
 
 
 @app.get("/validate-key")
-async def validate_key(key_info: dict = Depends(get_api_key)):
+async def validate_key(key_info: Mapping[str, Any] = Depends(get_api_key)):
     """Validate an API key and return tier information."""
     return {
         "valid": True,
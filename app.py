@@ -11,37 +11,48 @@ Supports:
 """
 
 import re
+import functools
+import operator
 import streamlit as st
-import pandas as pd
-from typing import List, Dict, Any, Optional, Tuple
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta, timezone
-from fitparse import FitFile
+
+# pandas is only needed once a FIT file is decoded, so it is imported there
+# and importing this module (as the API's analysis pipeline does) stays cheap.
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Muscat timezone (UTC+4)
 MUSCAT_TZ = timezone(timedelta(hours=4))
 
+# Report emoji per sport (anything else is shown as running)
+SPORT_EMOJI = {'swimming': '🏊', 'cycling': '🚴', 'running': '🏃'}
+
+# Display names for FORM stroke codes
+STROKE_NAMES = {'FR': 'Free', 'BR': 'Breast', 'BA': 'Back', 'FL': 'Fly'}
+
 # =============================================================================
 # UTILITY FUNCTIONS
 # =============================================================================
 
+@functools.lru_cache(maxsize=4096)
+def format_minutes_seconds(total_seconds: int) -> str:
+    """Format whole seconds as M:SS, cached since paces and durations repeat across laps."""
+    return f"{total_seconds // 60}:{total_seconds % 60:02d}"
+
+
 def format_pace(speed_ms: float) -> str:
     """Convert speed (m/s) to pace (min:sec/km) for running."""
     if speed_ms <= 0:
         return "--:--"
-    pace_sec_per_km = 1000 / speed_ms
-    minutes = int(pace_sec_per_km // 60)
-    seconds = int(pace_sec_per_km % 60)
-    return f"{minutes}:{seconds:02d}"
+    return format_minutes_seconds(int(1000 / speed_ms))
 
 
 def format_swim_pace(speed_ms: float) -> str:
     """Convert speed (m/s) to swim pace (min:sec/100m)."""
     if speed_ms <= 0:
         return "--:--"
-    pace_sec_per_100m = 100 / speed_ms
-    minutes = int(pace_sec_per_100m // 60)
-    seconds = int(pace_sec_per_100m % 60)
-    return f"{minutes}:{seconds:02d}"
+    return format_minutes_seconds(int(100 / speed_ms))
 
 
 def format_speed(speed_ms: float) -> str:
@@ -56,7 +67,7 @@ def format_duration(seconds: int) -> str:
     if seconds < 0:
         seconds = 0
     if seconds < 3600:
-        return f"{seconds // 60}:{seconds % 60:02d}"
+        return format_minutes_seconds(seconds)
     else:
         hours = seconds // 3600
         mins = (seconds % 3600) // 60
@@ -70,36 +81,35 @@ def convert_to_local_time(dt, tz=MUSCAT_TZ) -> datetime:
         return None
     if isinstance(dt, datetime):
         if dt.tzinfo is None:
+            if isinstance(tz, timezone):
+                # Fixed offset (like Muscat): shift the naive UTC time directly
+                return (dt + tz.utcoffset(None)).replace(tzinfo=tz)
             dt = dt.replace(tzinfo=timezone.utc)
         return dt.astimezone(tz)
     return dt
 
 
+# Pace strings as written in plans ("5:41")
+RE_PACE_TEXT = re.compile(r'\s*(\d+):(\d+)\s*$')
+
+
 def parse_pace_to_speed(pace_str: str) -> float:
     """Convert pace string (e.g., "5:41" min/km) to speed in m/s."""
-    try:
-        parts = pace_str.strip().split(':')
-        if len(parts) == 2:
-            minutes, seconds = int(parts[0]), int(parts[1])
-            total_seconds = minutes * 60 + seconds
-            if total_seconds > 0:
-                return 1000 / total_seconds
-    except:
-        pass
+    match = RE_PACE_TEXT.match(pace_str)
+    if match:
+        total_seconds = int(match.group(1)) * 60 + int(match.group(2))
+        if total_seconds > 0:
+            return 1000 / total_seconds
     return 0
 
 
 def parse_swim_pace_to_speed(pace_str: str) -> float:
     """Convert swim pace string (e.g., "2:40" min/100m) to speed in m/s."""
-    try:
-        parts = pace_str.strip().split(':')
-        if len(parts) == 2:
-            minutes, seconds = int(parts[0]), int(parts[1])
-            total_seconds = minutes * 60 + seconds
-            if total_seconds > 0:
-                return 100 / total_seconds
-    except:
-        pass
+    match = RE_PACE_TEXT.match(pace_str)
+    if match:
+        total_seconds = int(match.group(1)) * 60 + int(match.group(2))
+        if total_seconds > 0:
+            return 100 / total_seconds
     return 0
 
 
@@ -107,58 +117,86 @@ def parse_swim_pace_to_speed(pace_str: str) -> float:
 # REGEX PARSER FOR INTERVALS.ICU FORMAT
 # =============================================================================
 
+# Plan patterns are compiled once at import.
+# Line dispatch:
+# "4x" alone starts a multi-line set; "4x Work 8:00, Rest 2m" is an inline set (group 2).
+RE_MULTIPLIER = re.compile(r'^(\d+)\s*[xX](?:\s*$|\s+(.+))')
+RE_SET_BREAK = re.compile(r'^(Warm up \d|Cool Down)', re.IGNORECASE)
+RE_INLINE_SPLIT = re.compile(r',\s*(?=[A-Za-z])')
+
+# Duration text (MM:SS, Xm, Xs)
+RE_DURATION_MMSS = re.compile(r'(\d+):(\d+)')
+RE_DURATION_MIN = re.compile(r'(\d+)\s*m', re.IGNORECASE)
+RE_DURATION_SEC = re.compile(r'(\d+)\s*s', re.IGNORECASE)
+
+# Interval line label prefix ("Warm Up:", "Main Set:", ...)
+RE_LABEL_PREFIX = re.compile(r'^(Warm Up|Main Set|Warm Down|Cool Down):\s*', re.IGNORECASE)
+
+# Interval line fields, scanned in a single pass over the lowercased line
+# (so no IGNORECASE). Each alternative is wrapped in a named group so
+# match.lastgroup identifies the field; the first match of each field wins,
+# as with separate searches.
+RE_INTERVAL_FIELDS = re.compile(r'''
+      (?P<km> (?P<km_value>[\d.]+) \s*km (?=\s|$) )
+    | (?P<meters> (?P<meters_value>\d+) (?P<meters_gap>\s*) m (?=\s|$) )
+    | (?P<seconds> (?<!\S) (?P<seconds_value>\d+) s (?=\s|$) )
+    | (?P<mmss> (?<!\S) \d+:\d+ (?=\s|$) )
+    | (?P<swim_pace> pace \s* \( (?P<swim_fast>\d+:\d+) - (?P<swim_slow>\d+:\d+) \) )
+    | (?P<pace> \( (?P<pace_fast>\d+:\d+) - (?P<pace_slow>\d+:\d+) \) )
+    | (?P<power> \( (?P<power_min>\d+) - (?P<power_max>\d+) \s*w \) )
+    | (?P<intensity> (?P<intensity_min>\d+) - (?P<intensity_max>\d+) % )
+''', re.VERBOSE)
+
+
 def parse_duration_text(duration_str: str) -> int:
     """Parse duration string to seconds. Supports: MM:SS, Xm, Xs"""
-    match = re.match(r'(\d+):(\d+)', duration_str)
+    match = RE_DURATION_MMSS.match(duration_str)
     if match:
         return int(match.group(1)) * 60 + int(match.group(2))
-    match = re.match(r'(\d+)\s*m', duration_str, re.IGNORECASE)
+    match = RE_DURATION_MIN.match(duration_str)
     if match:
         return int(match.group(1)) * 60
-    match = re.match(r'(\d+)\s*s', duration_str, re.IGNORECASE)
+    match = RE_DURATION_SEC.match(duration_str)
     if match:
         return int(match.group(1))
     return 0
 
 
+# Interval type keywords, checked in priority order; anything else is WORK
+INTERVAL_TYPE_KEYWORDS = (
+    ('RECOVERY', re.compile(r'rest|recovery|easy|off|active')),
+    ('WARMUP', re.compile(r'warm(?:up| up|-up| down)')),
+    ('COOL', re.compile(r'cool')),  # cooldown, cool down, cool-down
+)
+
+# Swim stroke keywords in priority order (longer names like "backstroke" contain these)
+SWIM_STROKE_KEYWORDS = {
+    'fs': 'Freestyle',
+    'free': 'Freestyle',
+    'back': 'Backstroke',
+    'breast': 'Breaststroke',
+    'fly': 'Butterfly',
+    'im': 'IM',
+    'pull': 'Pull',
+    'kick': 'Kick',
+    'drill': 'Drill',
+    'choice': 'Choice',
+}
+
+
 def get_interval_type(text: str) -> str:
     """Extract interval type from text based on keywords."""
     text_lower = text.lower()
-    # Rest/Recovery
-    if any(kw in text_lower for kw in ['rest', 'recovery', 'easy', 'off', 'active']):
-        return 'RECOVERY'
-    # Warmup
-    if any(kw in text_lower for kw in ['warmup', 'warm up', 'warm-up', 'warm down']):
-        return 'WARMUP'
-    # Cooldown
-    if any(kw in text_lower for kw in ['cooldown', 'cool down', 'cool-down', 'cool']):
-        return 'COOL'
-    # Work
-    if any(kw in text_lower for kw in ['work', 'hard', 'harder', 'on', 'interval', 'main set']):
-        return 'WORK'
+    for interval_type, keywords in INTERVAL_TYPE_KEYWORDS:
+        if keywords.search(text_lower):
+            return interval_type
     return 'WORK'
 
 
 def get_swim_stroke(text: str) -> Optional[str]:
     """Extract swim stroke type from text."""
     text_lower = text.lower()
-    stroke_map = {
-        'fs': 'Freestyle',
-        'freestyle': 'Freestyle',
-        'free': 'Freestyle',
-        'back': 'Backstroke',
-        'backstroke': 'Backstroke',
-        'breast': 'Breaststroke',
-        'breaststroke': 'Breaststroke',
-        'fly': 'Butterfly',
-        'butterfly': 'Butterfly',
-        'im': 'IM',
-        'pull': 'Pull',
-        'kick': 'Kick',
-        'drill': 'Drill',
-        'choice': 'Choice',
-    }
-    for key, stroke in stroke_map.items():
+    for key, stroke in SWIM_STROKE_KEYWORDS.items():
         if key in text_lower:
             return stroke
     return None
@@ -171,80 +209,81 @@ def parse_intervals_icu_line(line: str) -> Optional[Dict[str, Any]]:
         return None
     
     # Remove labels like "Warm Up:", "Main Set:", "Warm Down:"
-    line = re.sub(r'^(Warm Up|Main Set|Warm Down|Cool Down):\s*', '', line, flags=re.IGNORECASE)
+    line = RE_LABEL_PREFIX.sub('', line)
     
     if not line:
         return None
     
-    interval_type = get_interval_type(line)
-    swim_stroke = get_swim_stroke(line)
+    line_lower = line.lower()
+    interval_type = get_interval_type(line_lower)
+    swim_stroke = get_swim_stroke(line_lower)
+    
+    # Find distance, duration, pace, power and intensity in one scan of the line
+    fields = {}
+    for match in RE_INTERVAL_FIELDS.finditer(line_lower):
+        field = match.lastgroup
+        fields.setdefault(field, match)
+        # "5m" is both a distance and, when it stands alone, a duration in minutes
+        if field == 'meters' and not match.group('meters_gap') and (
+            match.start() == 0 or line_lower[match.start() - 1].isspace()
+        ):
+            fields.setdefault('minutes', match)
     
     # Extract distance for swim (e.g., "0.1km" or "0.05km" or "100m")
     target_distance = None
-    dist_match = re.search(r'([\d.]+)\s*km(?:\s|$)', line, re.IGNORECASE)
-    if dist_match:
-        target_distance = float(dist_match.group(1)) * 1000  # Convert to meters
-    else:
-        dist_match = re.search(r'(\d+)\s*m(?:\s|$)', line, re.IGNORECASE)
-        if dist_match:
-            target_distance = float(dist_match.group(1))
+    if 'km' in fields:
+        target_distance = float(fields['km'].group('km_value')) * 1000  # Convert to meters
+    elif 'meters' in fields:
+        target_distance = float(fields['meters'].group('meters_value'))
     
     # Extract duration - priority: Xm (minutes), Xs (seconds), then MM:SS (but not pace in parens)
     duration_seconds = 0
     
-    # First check for minutes format (e.g., "5m", "8m") - most explicit
-    min_match = re.search(r'(?:^|\s)(\d+)m(?:\s|$)', line, re.IGNORECASE)
-    if min_match:
-        duration_seconds = int(min_match.group(1)) * 60
-    else:
-        # Check for seconds format (e.g., "15s", "20s")
-        sec_match = re.search(r'(?:^|\s)(\d+)s(?:\s|$)', line, re.IGNORECASE)
-        if sec_match:
-            duration_seconds = int(sec_match.group(1))
-        else:
-            # Check for MM:SS duration but NOT inside parentheses (those are pace values)
-            # Only match MM:SS at the start or after space, not after ( or -
-            time_match = re.search(r'(?:^|\s)(\d+:\d+)(?:\s|$)', line)
-            if time_match:
-                # Make sure it's not a pace value (check if followed by /km or inside parens)
-                match_start = time_match.start()
-                if '(' not in line[:match_start] or ')' in line[:match_start]:
-                    duration_seconds = parse_duration_text(time_match.group(1))
+    if 'minutes' in fields:
+        # Minutes format (e.g., "5m", "8m") - most explicit
+        duration_seconds = int(fields['minutes'].group('meters_value')) * 60
+    elif 'seconds' in fields:
+        # Seconds format (e.g., "15s", "20s")
+        duration_seconds = int(fields['seconds'].group('seconds_value'))
+    elif 'mmss' in fields:
+        # MM:SS duration at the start or after a space, but NOT a pace value in parentheses
+        time_match = fields['mmss']
+        match_start = time_match.start()
+        if '(' not in line_lower[:match_start] or ')' in line_lower[:match_start]:
+            duration_seconds = parse_duration_text(time_match.group('mmss'))
     
     # Extract pace range for running (e.g., "6:01-6:41") 
     pace_range = None
     target_pace_min_ms = None
     target_pace_max_ms = None
     
-    # For swim pace (per 100m), look for pattern like "(2:47-3:03)"
-    swim_pace_match = re.search(r'Pace\s*\((\d+:\d+)-(\d+:\d+)\)', line, re.IGNORECASE)
-    if swim_pace_match:
-        pace_range = f"{swim_pace_match.group(1)}–{swim_pace_match.group(2)}"
-        target_pace_min_ms = parse_swim_pace_to_speed(swim_pace_match.group(2))
-        target_pace_max_ms = parse_swim_pace_to_speed(swim_pace_match.group(1))
-    else:
+    if 'swim_pace' in fields:
+        # Swim pace (per 100m), pattern like "Pace (2:47-3:03)"
+        fast, slow = fields['swim_pace'].group('swim_fast', 'swim_slow')
+        pace_range = f"{fast}–{slow}"
+        target_pace_min_ms = parse_swim_pace_to_speed(slow)
+        target_pace_max_ms = parse_swim_pace_to_speed(fast)
+    elif 'pace' in fields:
         # Running pace
-        pace_match = re.search(r'\((\d+:\d+)-(\d+:\d+)\)', line)
-        if pace_match:
-            pace_range = f"{pace_match.group(1)}–{pace_match.group(2)}"
-            target_pace_min_ms = parse_pace_to_speed(pace_match.group(2))
-            target_pace_max_ms = parse_pace_to_speed(pace_match.group(1))
+        fast, slow = fields['pace'].group('pace_fast', 'pace_slow')
+        pace_range = f"{fast}–{slow}"
+        target_pace_min_ms = parse_pace_to_speed(slow)
+        target_pace_max_ms = parse_pace_to_speed(fast)
     
     # Extract power range for cycling (e.g., "115-172w")
     power_range = None
     target_power_min = None
     target_power_max = None
-    power_match = re.search(r'\((\d+)-(\d+)\s*w\)', line, re.IGNORECASE)
-    if power_match:
-        target_power_min = int(power_match.group(1))
-        target_power_max = int(power_match.group(2))
+    if 'power' in fields:
+        target_power_min = int(fields['power'].group('power_min'))
+        target_power_max = int(fields['power'].group('power_max'))
         power_range = f"{target_power_min}–{target_power_max}W"
     
     # Extract intensity % (e.g., "80-89%")
     intensity_range = None
-    intensity_match = re.search(r'(\d+)-(\d+)%', line)
-    if intensity_match:
-        intensity_range = f"{intensity_match.group(1)}–{intensity_match.group(2)}%"
+    if 'intensity' in fields:
+        low, high = fields['intensity'].group('intensity_min', 'intensity_max')
+        intensity_range = f"{low}–{high}%"
     
     return {
         'type': interval_type,
@@ -262,77 +301,107 @@ def parse_intervals_icu_line(line: str) -> Optional[Dict[str, Any]]:
     }
 
 
+# Plan line kinds, assigned once per line before parsing
+LINE_BLANK, LINE_COMMENT, LINE_MULTIPLIER, LINE_INLINE_SET, LINE_SET_BREAK, LINE_INTERVAL = range(6)
+
+
+def classify_plan_line(line: str) -> Tuple[int, Optional[re.Match]]:
+    """Classify a stripped plan line, returning its kind and multiplier match."""
+    if not line:
+        return LINE_BLANK, None
+    if line.startswith('#'):
+        return LINE_COMMENT, None
+    multiplier = RE_MULTIPLIER.match(line)
+    if multiplier:
+        return (LINE_MULTIPLIER if multiplier.group(2) is None else LINE_INLINE_SET), multiplier
+    if RE_SET_BREAK.match(line):
+        return LINE_SET_BREAK, None
+    return LINE_INTERVAL, None
+
+
+def expand_repetitions(sub_intervals: List[Dict[str, Any]], repetitions: int) -> List[Dict[str, Any]]:
+    """Repeat a set's intervals once per round, tagging each with its round number.
+    
+    Every round but the last gets copies; the last reuses the freshly parsed
+    dicts, so a single-round set is not copied at all.
+    """
+    expanded = []
+    for round_num in range(1, repetitions + 1):
+        round_number = round_num if repetitions > 1 else None
+        last_round = round_num == repetitions
+        for interval in sub_intervals:
+            new_interval = interval if last_round else interval.copy()
+            new_interval['round_number'] = round_number
+            expanded.append(new_interval)
+    return expanded
+
+
 def parse_plan_text(text: str) -> Tuple[List[Dict[str, Any]], int]:
     """Parse the entire plan text into a list of planned blocks.
     
     Handles intervals.icu format with blank lines between sets.
+    Streamlit reruns the script on every interaction, so parses are cached by
+    plan text; callers get fresh copies of the blocks.
     """
+    planned_blocks, num_rounds = _parse_plan_text_cached(text)
+    return [block.copy() for block in planned_blocks], num_rounds
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_plan_text_cached(text: str) -> Tuple[Tuple[Dict[str, Any], ...], int]:
+    """Parse plan text once per distinct text (see parse_plan_text)."""
     planned_blocks = []
-    # Remove excessive blank lines but preserve structure
-    lines = text.strip().split('\n')
+    # Classify every line up front so the set look-ahead below only checks kinds
+    lines = [line.strip() for line in text.strip().split('\n')]
+    classified = [classify_plan_line(line) for line in lines]
     num_rounds = 0
     
     i = 0
     while i < len(lines):
-        line = lines[i].strip()
+        line = lines[i]
+        kind, multiplier = classified[i]
         
         # Skip empty lines and comments
-        if not line or line.startswith('#'):
+        if kind == LINE_BLANK or kind == LINE_COMMENT:
             i += 1
             continue
         
-        # Check for standalone multiplier (e.g., "4x" or "1x" or "2x")
-        standalone_mult = re.match(r'^(\d+)\s*[xX]\s*$', line)
-        if standalone_mult:
-            repetitions = int(standalone_mult.group(1))
+        # Standalone multiplier (e.g., "4x" or "1x" or "2x")
+        if kind == LINE_MULTIPLIER:
+            repetitions = int(multiplier.group(1))
             if repetitions > 1:
                 num_rounds = max(num_rounds, repetitions)
             i += 1
             
-            # Skip any blank lines after the multiplier
-            while i < len(lines) and not lines[i].strip():
-                i += 1
+            # The set runs until the next multiplier (new set), a new warmup
+            # (like "Warm up 2") or Cool Down
+            set_end = i
+            while set_end < len(lines) and classified[set_end][0] not in (LINE_MULTIPLIER, LINE_SET_BREAK):
+                set_end += 1
             
-            # Collect following lines until next multiplier or section header
             sub_intervals = []
-            while i < len(lines):
-                next_line = lines[i].strip()
-                
+            for set_line in lines[i:set_end]:
                 # Skip blank lines within the set
-                if not next_line:
-                    i += 1
+                if not set_line:
                     continue
-                
-                # Stop at another multiplier (new set)
-                if re.match(r'^\d+\s*[xX]\s*$', next_line):
-                    break
-                # Stop at new warmup (like "Warm up 2") or Cool Down
-                if re.match(r'^(Warm up \d|Cool Down)', next_line, re.IGNORECASE):
-                    break
-                
-                interval = parse_intervals_icu_line(next_line)
+                interval = parse_intervals_icu_line(set_line)
                 if interval and (interval['duration_seconds'] > 0 or interval.get('target_distance_m')):
                     interval['is_main_set'] = True
                     sub_intervals.append(interval)
-                i += 1
+            i = set_end
             
             # Expand the repetitions
-            for round_num in range(repetitions):
-                for interval in sub_intervals:
-                    new_interval = interval.copy()
-                    new_interval['round_number'] = round_num + 1 if repetitions > 1 else None
-                    planned_blocks.append(new_interval)
+            planned_blocks.extend(expand_repetitions(sub_intervals, repetitions))
             continue
         
-        # Check for inline multiplier (e.g., "4x Work 8:00")
-        inline_mult = re.match(r'^(\d+)\s*[xX]\s+(.+)', line)
-        if inline_mult:
-            repetitions = int(inline_mult.group(1))
+        # Inline multiplier (e.g., "4x Work 8:00")
+        if kind == LINE_INLINE_SET:
+            repetitions = int(multiplier.group(1))
             if repetitions > 1:
                 num_rounds = max(num_rounds, repetitions)
-            rest_of_line = inline_mult.group(2)
+            rest_of_line = multiplier.group(2)
             
-            parts = re.split(r',\s*(?=[A-Za-z])', rest_of_line)
+            parts = RE_INLINE_SPLIT.split(rest_of_line)
             sub_intervals = []
             for part in parts:
                 interval = parse_intervals_icu_line(part)
@@ -340,11 +409,7 @@ def parse_plan_text(text: str) -> Tuple[List[Dict[str, Any]], int]:
                     interval['is_main_set'] = True
                     sub_intervals.append(interval)
             
-            for round_num in range(repetitions):
-                for interval in sub_intervals:
-                    new_interval = interval.copy()
-                    new_interval['round_number'] = round_num + 1 if repetitions > 1 else None
-                    planned_blocks.append(new_interval)
+            planned_blocks.extend(expand_repetitions(sub_intervals, repetitions))
             i += 1
             continue
         
@@ -356,64 +421,82 @@ def parse_plan_text(text: str) -> Tuple[List[Dict[str, Any]], int]:
         
         i += 1
     
-    return planned_blocks, num_rounds
+    return tuple(planned_blocks), num_rounds
 
 
 # =============================================================================
 # FIT FILE PARSER
 # =============================================================================
 
-def load_fit_file(uploaded_file) -> Tuple[Optional[pd.DataFrame], Optional[List[Dict]], Optional[Dict]]:
+def load_fit_file(uploaded_file) -> Tuple[Optional["pd.DataFrame"], Optional[List[Dict]], Optional[Dict]]:
     """Load and parse a FIT file using TRUE in-memory processing (no disk writes).
     
     Uses fitdecode which supports file-like objects (BytesIO).
     This is the core of the Ephemeral Pipeline - zero disk trace.
+    Frames are decoded as a stream with CRC checking disabled, matching the
+    API: fitdecode only warns on a bad CRC, so checking it changes nothing.
     """
     try:
         import io
         import fitdecode
+        import pandas as pd
         
-        fit_bytes = uploaded_file.read()
-        uploaded_file.seek(0)
-        
-        # True in-memory processing with fitdecode
-        mem_file = io.BytesIO(fit_bytes)
+        # True in-memory processing with fitdecode. Streamlit's UploadedFile is
+        # already an in-memory file, so it is read directly rather than copied.
+        if hasattr(uploaded_file, 'seek'):
+            uploaded_file.seek(0)
+            mem_file = uploaded_file
+        else:
+            mem_file = io.BytesIO(uploaded_file.read())
         
         session_info = {}
-        records = []
+        # Records are collected column-wise (one list per field) for the DataFrame
+        record_columns = {}
+        get_record_column = record_columns.get
+        num_records = 0
         laps = []
         
-        with fitdecode.FitReader(mem_file) as fit:
+        with fitdecode.FitReader(mem_file, check_crc=fitdecode.CrcCheck.DISABLED) as fit:
             for frame in fit:
                 if not isinstance(frame, fitdecode.FitDataMessage):
                     continue
                 
-                # Session data
-                if frame.name == 'session':
+                # Record data (for time series) - by far the most common frame
+                name = frame.name
+                if name == 'record':
                     for field in frame.fields:
-                        session_info[field.name] = field.value
+                        field_name = field.name
+                        column = get_record_column(field_name)
+                        if column is None:
+                            # Field first seen mid-file: earlier records lack it
+                            column = record_columns[field_name] = [None] * num_records
+                        elif len(column) != num_records:
+                            if len(column) > num_records:
+                                column.pop()  # repeated field name, last value wins
+                            else:
+                                column.extend([None] * (num_records - len(column)))
+                        column.append(field.value)
+                    num_records += 1
                 
-                # Record data (for time series)
-                elif frame.name == 'record':
-                    record_data = {}
-                    for field in frame.fields:
-                        record_data[field.name] = field.value
-                    records.append(record_data)
+                # Session data
+                elif name == 'session':
+                    session_info.update({field.name: field.value for field in frame.fields})
                 
                 # Lap data
-                elif frame.name == 'lap':
-                    lap_data = {}
-                    for field in frame.fields:
-                        lap_data[field.name] = field.value
-                    laps.append(lap_data)
+                elif name == 'lap':
+                    laps.append({field.name: field.value for field in frame.fields})
                 
                 # VO2 max from unknown message type 140
-                elif frame.name == 'unknown_140':
+                elif name == 'unknown_140':
                     for field in frame.fields:
                         if field.name == 'unknown_29' and field.value is not None:
                             session_info['vo2_max'] = round(field.value / 18724.7, 2)
         
-        df = pd.DataFrame(records) if records else None
+        df = None
+        if num_records:
+            for column in record_columns.values():
+                column.extend([None] * (num_records - len(column)))
+            df = pd.DataFrame(record_columns)
         
         return df, laps, session_info
     
@@ -427,14 +510,16 @@ def load_fit_file(uploaded_file) -> Tuple[Optional[pd.DataFrame], Optional[List[
 def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int = 5) -> List[Dict[str, Any]]:
     """Process raw FIT lap data with sport-specific metrics."""
     processed_laps = []
+    # Sport-specific choices are fixed for the whole activity, so resolve them once
+    is_cycling = sport == 'cycling'
+    is_swimming = sport == 'swimming'
+    cadence_scale = 2 if sport == 'running' else 1  # FIT running cadence counts one foot
+    # For swimming, include rest laps (distance=0) but skip very short laps
+    min_lap_seconds = 3 if is_swimming else min_duration
     
     for i, lap in enumerate(laps):
         total_elapsed_time = lap.get('total_elapsed_time', 0)
-        
-        # For swimming, include rest laps (distance=0) but skip very short laps
-        if sport != 'swimming' and total_elapsed_time < min_duration:
-            continue
-        if sport == 'swimming' and total_elapsed_time < 3:
+        if total_elapsed_time < min_lap_seconds:
             continue
         
         # Basic metrics
@@ -452,10 +537,10 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
         normalized_power = lap.get('normalized_power')
         
         # Cadence
-        if sport == 'cycling':
+        if is_cycling:
             avg_cadence = lap.get('avg_cadence')
             max_cadence = lap.get('max_cadence')
-        elif sport == 'swimming':
+        elif is_swimming:
             avg_cadence = lap.get('avg_cadence')  # Strokes per minute
             max_cadence = None
         else:
@@ -474,7 +559,7 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
         # Cycling-specific: L/R balance
         lr_balance = lap.get('left_right_balance')
         left_balance = None
-        if lr_balance and sport == 'cycling':
+        if lr_balance and is_cycling:
             # FIT encodes balance as: (left% * 100) | 0x8000 if right data available
             if isinstance(lr_balance, int):
                 left_balance = round((lr_balance & 0x7FFF) / 100, 1)
@@ -489,7 +574,7 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
         
         # Calculate SWOLF for swimming
         swolf = None
-        if sport == 'swimming' and num_lengths == 1 and total_strokes:
+        if is_swimming and num_lengths == 1 and total_strokes:
             swolf = int(total_elapsed_time) + total_strokes
         
         processed_lap = {
@@ -509,8 +594,8 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
             'avg_power': int(avg_power) if avg_power else None,
             'max_power': int(max_power) if max_power else None,
             'normalized_power': int(normalized_power) if normalized_power else None,
-            'cadence': int(avg_cadence * 2) if avg_cadence and sport == 'running' else (int(avg_cadence) if avg_cadence else None),
-            'max_cadence': int(max_cadence * 2) if max_cadence and sport == 'running' else (int(max_cadence) if max_cadence else None),
+            'cadence': int(avg_cadence * cadence_scale) if avg_cadence else None,
+            'max_cadence': int(max_cadence * cadence_scale) if max_cadence else None,
             'swim_stroke': swim_stroke,
             'total_strokes': total_strokes,
             'num_lengths': num_lengths,
@@ -521,7 +606,7 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
             'total_ascent': total_ascent or 0,
             'total_descent': total_descent or 0,
             'left_balance': left_balance,
-            'is_rest': total_distance == 0 or (sport == 'swimming' and num_lengths == 0),
+            'is_rest': total_distance == 0 or (is_swimming and num_lengths == 0),
         }
         
         processed_laps.append(processed_lap)
@@ -533,6 +618,10 @@ def process_fit_laps(laps: List[Dict], sport: str = 'running', min_duration: int
 # FORM GOGGLES CSV PARSER
 # =============================================================================
 
+# FORM exports repeat the same few hundred time and pace strings across lengths
+# (every rest row is "0:00.00"), so the per-cell parsers below are memoized.
+
+@functools.lru_cache(maxsize=4096)
 def parse_form_time(time_str: str) -> float:
     """Parse FORM time format (M:SS.xx or H:MM:SS.xx) to seconds."""
     if not time_str or time_str == '0:00.00':
@@ -550,6 +639,7 @@ def parse_form_time(time_str: str) -> float:
         return 0.0
 
 
+@functools.lru_cache(maxsize=4096)
 def parse_form_pace(pace_str: str) -> str:
     """Parse FORM pace format (M:SS.xx) to standard format (M:SS)."""
     if not pace_str or pace_str == '0:00.00':
@@ -565,6 +655,30 @@ def parse_form_pace(pace_str: str) -> str:
         return '--:--'
 
 
+# Per-length columns read from a FORM export, with the value used when a column is missing
+FORM_LENGTH_COLUMNS = (
+    ('Set #', '0'),
+    ('Set', ''),
+    ('Interval (m)', '0'),
+    ('Length (m)', '0'),
+    ('Strk', 'REST'),
+    ('Move Time', '0:00.00'),
+    ('Rest Time', '0:00.00'),
+    ('Cumul Time', '0:00.00'),
+    ('Cumul Dist (m)', '0'),
+    ('Avg DPS', '0'),
+    ('Avg BPM (moving)', '0'),
+    ('Max BPM', '0'),
+    ('Min BPM (resting)', '0'),
+    ('Pace/100', '0:00.00'),
+    ('Pace/50', '0:00.00'),
+    ('SWOLF', '0'),
+    ('Avg Strk Rate (strk/min)', '0'),
+    ('Strk Count', '0'),
+    ('Calories', '0'),
+)
+
+
 def load_form_csv(uploaded_file) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
     """Load and parse a FORM goggles CSV file.
     
@@ -582,14 +696,14 @@ def load_form_csv(uploaded_file) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
             content = content.decode('utf-8')
         uploaded_file.seek(0)
         
-        lines = content.strip().split('\n')
+        # csv tokenizes rows in C and handles quoted commas in titles
+        reader = csv.reader(io.StringIO(content.strip()))
         
         # Parse header section (first 2 rows)
         session_info = {}
-        if len(lines) >= 2:
-            header_keys = lines[0].split(',')
-            header_values = lines[1].split(',')
-            
+        header_keys = next(reader, None)
+        header_values = next(reader, None)
+        if header_values is not None:
             for key, value in zip(header_keys, header_values):
                 key = key.strip()
                 value = value.strip()
@@ -604,55 +718,55 @@ def load_form_csv(uploaded_file) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
         
         # Parse data section (row 4 onwards, row 3 is header)
         lengths = []
-        if len(lines) >= 5:
-            # Row 4 (index 3) is the data header
-            data_header = lines[3].split(',')
-            
+        next(reader, None)
+        data_header = next(reader, None)
+        if data_header is not None:
             # Get column indices
             col_map = {}
             for i, col in enumerate(data_header):
                 col_map[col.strip()] = i
             
+            # Resolve every column once; missing columns index past the row
+            # into the defaults appended to it
+            width = len(data_header)
+            defaults = [default for _, default in FORM_LENGTH_COLUMNS]
+            pick = operator.itemgetter(*(
+                col_map.get(name, width + j) for j, (name, _) in enumerate(FORM_LENGTH_COLUMNS)
+            ))
+            
             # Parse each data row
-            for row_idx in range(4, len(lines)):
-                row = lines[row_idx].strip()
-                if not row:
-                    continue
-                
-                values = row.split(',')
-                if len(values) < len(data_header):
+            for values in reader:
+                if not values or len(values) < width:
                     continue
                 
-                def get_val(col_name, default=''):
-                    idx = col_map.get(col_name)
-                    if idx is not None and idx < len(values):
-                        return values[idx].strip()
-                    return default
+                (set_number, set_description, interval_m, distance_m, stroke,
+                 move_time, rest_time, cumul_time, cumul_dist, dps,
+                 avg_hr, max_hr, min_hr_rest, pace_100, pace_50,
+                 swolf, stroke_rate, stroke_count, calories) = pick([v.strip() for v in values[:width]] + defaults)
                 
                 # Parse the length data
-                stroke = get_val('Strk', 'REST')
-                is_rest = stroke == 'REST' or get_val('Length (m)', '0') == '0'
+                is_rest = stroke == 'REST' or distance_m == '0'
                 
                 length_data = {
-                    'set_number': int(get_val('Set #', '0') or 0),
-                    'set_description': get_val('Set', ''),
-                    'interval_m': int(get_val('Interval (m)', '0') or 0),
-                    'distance_m': int(get_val('Length (m)', '0') or 0),
+                    'set_number': int(set_number or 0),
+                    'set_description': set_description,
+                    'interval_m': int(interval_m or 0),
+                    'distance_m': int(distance_m or 0),
                     'stroke_type': stroke,
-                    'move_time': parse_form_time(get_val('Move Time', '0:00.00')),
-                    'rest_time': parse_form_time(get_val('Rest Time', '0:00.00')),
-                    'cumul_time': parse_form_time(get_val('Cumul Time', '0:00.00')),
-                    'cumul_dist': int(get_val('Cumul Dist (m)', '0') or 0),
-                    'dps': float(get_val('Avg DPS', '0') or 0),
-                    'avg_hr': int(get_val('Avg BPM (moving)', '0') or 0) or None,
-                    'max_hr': int(get_val('Max BPM', '0') or 0) or None,
-                    'min_hr_rest': int(get_val('Min BPM (resting)', '0') or 0) or None,
-                    'pace_100': parse_form_pace(get_val('Pace/100', '0:00.00')),
-                    'pace_50': parse_form_pace(get_val('Pace/50', '0:00.00')),
-                    'swolf': int(get_val('SWOLF', '0') or 0),
-                    'stroke_rate': int(get_val('Avg Strk Rate (strk/min)', '0') or 0),
-                    'stroke_count': int(get_val('Strk Count', '0') or 0),
-                    'calories': int(get_val('Calories', '0') or 0),
+                    'move_time': parse_form_time(move_time),
+                    'rest_time': parse_form_time(rest_time),
+                    'cumul_time': parse_form_time(cumul_time),
+                    'cumul_dist': int(cumul_dist or 0),
+                    'dps': float(dps or 0),
+                    'avg_hr': int(avg_hr or 0) or None,
+                    'max_hr': int(max_hr or 0) or None,
+                    'min_hr_rest': int(min_hr_rest or 0) or None,
+                    'pace_100': parse_form_pace(pace_100),
+                    'pace_50': parse_form_pace(pace_50),
+                    'swolf': int(swolf or 0),
+                    'stroke_rate': int(stroke_rate or 0),
+                    'stroke_count': int(stroke_count or 0),
+                    'calories': int(calories or 0),
                     'is_rest': is_rest,
                 }
                 
@@ -707,29 +821,44 @@ def _combine_form_lengths(lengths: List[Dict], pool_length: int) -> Optional[Dic
     if not lengths:
         return None
     
-    # Filter out pure rest entries for calculations
-    active_lengths = [l for l in lengths if not l['is_rest']]
+    # Accumulate totals in one pass; averages use active lengths only,
+    # skipping missing (zero) readings
+    total_distance = total_move_time = total_rest_time = total_calories = 0
+    num_active = total_strokes = 0
+    hr_sum = hr_count = swolf_sum = swolf_count = stroke_rate_sum = stroke_rate_count = 0
+    dps_sum = dps_count = 0
+    max_hr = None
+    
+    for l in lengths:
+        total_distance += l['distance_m']
+        total_move_time += l['move_time']
+        total_rest_time += l['rest_time']
+        total_calories += l['calories']
+        # Pure rest entries are left out of the averages
+        if l['is_rest']:
+            continue
+        num_active += 1
+        total_strokes += l['stroke_count']
+        if l['avg_hr']:
+            hr_sum += l['avg_hr']
+            hr_count += 1
+        if l['max_hr'] and (max_hr is None or l['max_hr'] > max_hr):
+            max_hr = l['max_hr']
+        if l['swolf']:
+            swolf_sum += l['swolf']
+            swolf_count += 1
+        if l['dps']:
+            dps_sum += l['dps']
+            dps_count += 1
+        if l['stroke_rate']:
+            stroke_rate_sum += l['stroke_rate']
+            stroke_rate_count += 1
     
-    total_distance = sum(l['distance_m'] for l in lengths)
-    total_move_time = sum(l['move_time'] for l in lengths)
-    total_rest_time = sum(l['rest_time'] for l in lengths)
     total_time = total_move_time + total_rest_time
-    
-    # Averages from active lengths only
-    hr_values = [l['avg_hr'] for l in active_lengths if l['avg_hr']]
-    max_hr_values = [l['max_hr'] for l in active_lengths if l['max_hr']]
-    swolf_values = [l['swolf'] for l in active_lengths if l['swolf']]
-    dps_values = [l['dps'] for l in active_lengths if l['dps']]
-    stroke_rate_values = [l['stroke_rate'] for l in active_lengths if l['stroke_rate']]
-    
-    avg_hr = int(sum(hr_values) / len(hr_values)) if hr_values else None
-    max_hr = max(max_hr_values) if max_hr_values else None
-    avg_swolf = int(sum(swolf_values) / len(swolf_values)) if swolf_values else None
-    avg_dps = round(sum(dps_values) / len(dps_values), 2) if dps_values else None
-    avg_stroke_rate = int(sum(stroke_rate_values) / len(stroke_rate_values)) if stroke_rate_values else None
-    
-    total_strokes = sum(l['stroke_count'] for l in active_lengths)
-    total_calories = sum(l['calories'] for l in lengths)
+    avg_hr = int(hr_sum / hr_count) if hr_count else None
+    avg_swolf = int(swolf_sum / swolf_count) if swolf_count else None
+    avg_dps = round(dps_sum / dps_count, 2) if dps_count else None
+    avg_stroke_rate = int(stroke_rate_sum / stroke_rate_count) if stroke_rate_count else None
     
     # Calculate pace
     avg_speed = total_distance / total_move_time if total_move_time > 0 else 0
@@ -755,7 +884,7 @@ def _combine_form_lengths(lengths: List[Dict], pool_length: int) -> Optional[Dic
         'stroke_rate': avg_stroke_rate,
         'total_strokes': total_strokes,
         'swim_stroke': first.get('stroke_type', 'FR'),
-        'num_lengths': len(active_lengths),
+        'num_lengths': num_active,
         'calories': total_calories,
         'is_rest': total_distance == 0,
         'source': 'FORM',
@@ -857,37 +986,10 @@ def group_laps_by_planned(planned_blocks: List[Dict], actual_laps: List[Dict], s
                 lap_index += 1
         
         if combined_laps:
-            total_duration = sum(l['duration_seconds'] for l in combined_laps)
-            total_distance = sum(l['distance_m'] for l in combined_laps)
-            avg_speed = total_distance / total_duration if total_duration > 0 else 0
-            
-            hr_values = [l['avg_hr'] for l in combined_laps if l.get('avg_hr')]
-            cadence_values = [l['cadence'] for l in combined_laps if l.get('cadence')]
-            power_values = [l['avg_power'] for l in combined_laps if l.get('avg_power')]
-            strokes = sum(l.get('total_strokes', 0) or 0 for l in combined_laps)
-            
             grouped.append({
                 'planned': planned,
                 'actual_laps': combined_laps,
-                'combined': {
-                    'sport': sport,
-                    'duration_seconds': total_duration,
-                    'distance_m': total_distance,
-                    'avg_speed_ms': avg_speed,
-                    'avg_pace': format_pace(avg_speed),
-                    'swim_pace': format_swim_pace(avg_speed),
-                    'avg_speed_kmh': format_speed(avg_speed),
-                    'start_hr': combined_laps[0].get('avg_hr'),
-                    'end_hr': combined_laps[-1].get('max_hr'),
-                    'avg_hr': sum(hr_values) / len(hr_values) if hr_values else None,
-                    'max_hr': max(l.get('max_hr', 0) or 0 for l in combined_laps),
-                    'cadence': int(sum(cadence_values) / len(cadence_values)) if cadence_values else None,
-                    'avg_power': int(sum(power_values) / len(power_values)) if power_values else None,
-                    'total_strokes': strokes,
-                    'swim_stroke': combined_laps[0].get('swim_stroke'),
-                    'is_rest': all(l.get('is_rest') for l in combined_laps),
-                    'num_laps_combined': len(combined_laps)
-                }
+                'combined': _combine_grouped_laps(combined_laps, sport),
             })
         else:
             grouped.append({'planned': planned, 'actual_laps': [], 'combined': None})
@@ -895,6 +997,52 @@ def group_laps_by_planned(planned_blocks: List[Dict], actual_laps: List[Dict], s
     return grouped
 
 
+def _combine_grouped_laps(laps: List[Dict], sport: str) -> Dict[str, Any]:
+    """Combine the actual laps matched to one planned block, in a single pass."""
+    total_duration = total_distance = strokes = max_hr = 0
+    hr_sum = hr_count = cadence_sum = cadence_count = power_sum = power_count = 0
+    is_rest = True
+    
+    for l in laps:
+        total_duration += l['duration_seconds']
+        total_distance += l['distance_m']
+        strokes += l.get('total_strokes', 0) or 0
+        max_hr = max(max_hr, l.get('max_hr', 0) or 0)
+        if l.get('avg_hr'):
+            hr_sum += l['avg_hr']
+            hr_count += 1
+        if l.get('cadence'):
+            cadence_sum += l['cadence']
+            cadence_count += 1
+        if l.get('avg_power'):
+            power_sum += l['avg_power']
+            power_count += 1
+        if is_rest and not l.get('is_rest'):
+            is_rest = False
+    
+    avg_speed = total_distance / total_duration if total_duration > 0 else 0
+    
+    return {
+        'sport': sport,
+        'duration_seconds': total_duration,
+        'distance_m': total_distance,
+        'avg_speed_ms': avg_speed,
+        'avg_pace': format_pace(avg_speed),
+        'swim_pace': format_swim_pace(avg_speed),
+        'avg_speed_kmh': format_speed(avg_speed),
+        'start_hr': laps[0].get('avg_hr'),
+        'end_hr': laps[-1].get('max_hr'),
+        'avg_hr': hr_sum / hr_count if hr_count else None,
+        'max_hr': max_hr,
+        'cadence': int(cadence_sum / cadence_count) if cadence_count else None,
+        'avg_power': int(power_sum / power_count) if power_count else None,
+        'total_strokes': strokes,
+        'swim_stroke': laps[0].get('swim_stroke'),
+        'is_rest': is_rest,
+        'num_laps_combined': len(laps)
+    }
+
+
 def calculate_overall_summary(actual_laps: List[Dict], session_info: Dict) -> Dict[str, Any]:
     """Calculate overall workout summary."""
     if not actual_laps:
@@ -903,24 +1051,35 @@ def calculate_overall_summary(actual_laps: List[Dict], session_info: Dict) -> Di
     sport = session_info.get('sport', 'running')
     is_swimming = sport == 'swimming'
     
-    # Exclude rest laps from totals for swimming
-    active_laps = [l for l in actual_laps if not l.get('is_rest')] if is_swimming else actual_laps
-    
-    total_duration = sum(lap['duration_seconds'] for lap in actual_laps)
-    total_distance = sum(lap['distance_m'] for lap in active_laps)
-    active_time = sum(lap['duration_seconds'] for lap in active_laps)
+    total_duration = total_distance = active_time = total_strokes = num_active = 0
+    hr_sum = hr_count = cadence_sum = cadence_count = power_sum = power_count = 0
+    max_hr = None
     
-    hr_values = [lap['avg_hr'] for lap in active_laps if lap.get('avg_hr')]
-    max_hr_values = [lap['max_hr'] for lap in active_laps if lap.get('max_hr')]
-    cadence_values = [lap['cadence'] for lap in active_laps if lap.get('cadence')]
-    power_values = [lap['avg_power'] for lap in active_laps if lap.get('avg_power')]
+    for lap in actual_laps:
+        total_duration += lap['duration_seconds']
+        # Exclude rest laps from totals for swimming
+        if is_swimming and lap.get('is_rest'):
+            continue
+        num_active += 1
+        total_distance += lap['distance_m']
+        active_time += lap['duration_seconds']
+        total_strokes += lap.get('total_strokes', 0) or 0
+        if lap.get('avg_hr'):
+            hr_sum += lap['avg_hr']
+            hr_count += 1
+        if lap.get('max_hr') and (max_hr is None or lap['max_hr'] > max_hr):
+            max_hr = lap['max_hr']
+        if lap.get('cadence'):
+            cadence_sum += lap['cadence']
+            cadence_count += 1
+        if lap.get('avg_power'):
+            power_sum += lap['avg_power']
+            power_count += 1
     
     overall_pace = format_pace(total_distance / active_time) if active_time > 0 else "--:--"
     overall_swim_pace = format_swim_pace(total_distance / active_time) if active_time > 0 else "--:--"
     overall_speed = format_speed(total_distance / active_time) if active_time > 0 else "--.-"
     
-    total_strokes = sum(l.get('total_strokes', 0) or 0 for l in active_laps)
-    
     return {
         'sport': sport,
         'activity_name': session_info.get('activity_name', 'Activity'),
@@ -932,10 +1091,10 @@ def calculate_overall_summary(actual_laps: List[Dict], session_info: Dict) -> Di
         'overall_pace': overall_pace,
         'overall_swim_pace': overall_swim_pace,
         'overall_speed': overall_speed,
-        'avg_hr': int(sum(hr_values)/len(hr_values)) if hr_values else None,
-        'max_hr': int(max(max_hr_values)) if max_hr_values else None,
-        'avg_cadence': int(sum(cadence_values)/len(cadence_values)) if cadence_values else None,
-        'avg_power': int(sum(power_values)/len(power_values)) if power_values else None,
+        'avg_hr': int(hr_sum / hr_count) if hr_count else None,
+        'max_hr': int(max_hr) if max_hr is not None else None,
+        'avg_cadence': int(cadence_sum / cadence_count) if cadence_count else None,
+        'avg_power': int(power_sum / power_count) if power_count else None,
         'normalized_power': session_info.get('normalized_power'),
         'intensity_factor': session_info.get('intensity_factor'),
         'tss': session_info.get('tss'),
@@ -945,7 +1104,7 @@ def calculate_overall_summary(actual_laps: List[Dict], session_info: Dict) -> Di
         'calories': session_info.get('total_calories'),
         'training_effect': session_info.get('training_effect'),
         'total_laps': len(actual_laps),
-        'active_laps': len(active_laps),
+        'active_laps': num_active,
         'total_strokes': total_strokes,
         'num_lengths': session_info.get('num_active_lengths'),
         'left_balance': session_info.get('left_balance'),
@@ -957,6 +1116,20 @@ def calculate_overall_summary(actual_laps: List[Dict], session_info: Dict) -> Di
 # FORMATTED OUTPUT GENERATION
 # =============================================================================
 
+def _split_plan_sections(items: List, planned) -> Tuple[List, List, List]:
+    """Split items into warm-up, main set and cool-down lists by their planned interval."""
+    warmup, main_set, cooldown = [], [], []
+    for item, p in zip(items, planned):
+        interval_type = p['type']
+        if interval_type == 'WARMUP':
+            warmup.append(item)
+        elif interval_type == 'COOL':
+            cooldown.append(item)
+        if p.get('is_main_set', False):
+            main_set.append(item)
+    return warmup, main_set, cooldown
+
+
 def generate_detailed_output(
     planned_blocks: List[Dict], 
     num_rounds: int,
@@ -966,12 +1139,14 @@ def generate_detailed_output(
 ) -> str:
     """Generate the detailed formatted output."""
     output = []
+    add = output.append
+    extend = output.extend
     sport = summary.get('sport', 'running')
     is_cycling = sport == 'cycling'
     is_swimming = sport == 'swimming'
     
     # Emoji based on sport
-    emoji = "🏊" if is_swimming else ("🚴" if is_cycling else "🏃")
+    emoji = SPORT_EMOJI.get(sport, "🏃")
     
     # Header
     activity_name = summary.get('activity_name', 'Activity')
@@ -979,168 +1154,153 @@ def generate_detailed_output(
     temp = summary.get('avg_temp')
     pool_length = summary.get('pool_length')
     
-    output.append(f"# {emoji} {activity_name} Workout Analysis")
+    add(f"# {emoji} {activity_name} Workout Analysis")
     if start_time and isinstance(start_time, datetime):
-        output.append(f"**Date:** {start_time.strftime('%A, %B %d, %Y')}")
-        output.append(f"**Time:** {start_time.strftime('%H:%M')} (Local)")
+        add(f"**Date:** {start_time.strftime('%A, %B %d, %Y')}")
+        add(f"**Time:** {start_time.strftime('%H:%M')} (Local)")
     if pool_length:
-        output.append(f"**Pool:** {int(pool_length)}m")
+        add(f"**Pool:** {int(pool_length)}m")
     if temp:
-        output.append(f"**Temperature:** {temp}°C")
-    output.append("")
+        add(f"**Temperature:** {temp}°C")
+    add("")
     
     # Planned section
-    output.append("---")
-    output.append("## 📋 PLANNED WORKOUT\n")
+    extend(("---", "## 📋 PLANNED WORKOUT\n"))
     
-    warmup_planned = [p for p in planned_blocks if p['type'] == 'WARMUP']
-    cooldown_planned = [p for p in planned_blocks if p['type'] == 'COOL']
-    main_set_planned = [p for p in planned_blocks if p.get('is_main_set', False)]
+    warmup_planned, main_set_planned, cooldown_planned = _split_plan_sections(planned_blocks, planned_blocks)
     
     if warmup_planned:
-        output.append("### Warm-Up")
-        for p in warmup_planned:
-            output.append(format_planned_interval(p, sport))
-        output.append("")
+        add("### Warm-Up")
+        extend(format_planned_interval(p, sport) for p in warmup_planned)
+        add("")
     
     if main_set_planned:
         if num_rounds > 1:
-            output.append(f"### Main Set — {num_rounds} Rounds")
+            add(f"### Main Set — {num_rounds} Rounds")
             intervals_per_round = len(main_set_planned) // num_rounds
-            for i in range(intervals_per_round):
-                output.append(format_planned_interval(main_set_planned[i], sport))
+            extend(format_planned_interval(p, sport) for p in main_set_planned[:intervals_per_round])
         else:
-            output.append("### Main Set")
-            for p in main_set_planned:
-                output.append(format_planned_interval(p, sport))
-        output.append("")
+            add("### Main Set")
+            extend(format_planned_interval(p, sport) for p in main_set_planned)
+        add("")
     
     if cooldown_planned:
-        output.append("### Cool Down")
-        for p in cooldown_planned:
-            output.append(format_planned_interval(p, sport))
-        output.append("")
+        add("### Cool Down")
+        extend(format_planned_interval(p, sport) for p in cooldown_planned)
+        add("")
     
     # Actual section
-    output.append("---")
-    output.append(f"## {emoji} ACTUAL WORKOUT\n")
+    extend(("---", f"## {emoji} ACTUAL WORKOUT\n"))
     
-    warmup_data = [g for g in grouped_data if g['planned']['type'] == 'WARMUP']
+    warmup_data, main_set_data, cooldown_data = _split_plan_sections(
+        grouped_data, map(operator.itemgetter('planned'), grouped_data))
     if warmup_data:
-        output.append("### Warm-Up (Actual)")
+        add("### Warm-Up (Actual)")
         for i, g in enumerate(warmup_data, 1):
             if g['combined']:
-                output.append(f"{i}. {format_combined_lap(g['combined'], sport)}")
-        output.append("")
+                add(f"{i}. {format_combined_lap(g['combined'], sport)}")
+        add("")
     
-    main_set_data = [g for g in grouped_data if g['planned'].get('is_main_set', False)]
     if main_set_data:
-        output.append("---")
-        output.append("")
-        output.append("### MAIN SET (Actual)")
-        output.append("")
+        extend(("---", "", "### MAIN SET (Actual)", ""))
         
         if num_rounds > 1:
             intervals_per_round = len(main_set_data) // num_rounds
             for round_num in range(num_rounds):
-                output.append(f"#### ROUND {round_num + 1}")
+                add(f"#### ROUND {round_num + 1}")
                 start_idx = round_num * intervals_per_round
                 for g in main_set_data[start_idx:start_idx + intervals_per_round]:
                     if g['combined']:
                         p = g['planned']
                         label = format_planned_label(p, sport)
-                        output.append(f"**{label}:** {format_combined_lap(g['combined'], sport)}  ")
-                output.append("")
-                output.append("---")
-                output.append("")
+                        add(f"**{label}:** {format_combined_lap(g['combined'], sport)}  ")
+                extend(("", "---", ""))
         else:
             for g in main_set_data:
                 if g['combined']:
                     p = g['planned']
                     label = format_planned_label(p, sport)
-                    output.append(f"**{label}:** {format_combined_lap(g['combined'], sport)}  ")
-            output.append("")
-            output.append("---")
-            output.append("")
+                    add(f"**{label}:** {format_combined_lap(g['combined'], sport)}  ")
+            extend(("", "---", ""))
     
-    cooldown_data = [g for g in grouped_data if g['planned']['type'] == 'COOL']
     if cooldown_data:
-        output.append("### Cool Down (Actual)")
+        add("### Cool Down (Actual)")
         for g in cooldown_data:
             if g['combined']:
-                output.append(f"- {format_combined_lap(g['combined'], sport)}")
-        output.append("")
+                add(f"- {format_combined_lap(g['combined'], sport)}")
+        add("")
     
     # Summary
-    output.append("---")
-    output.append("## 📊 WORKOUT SUMMARY")
-    output.append("")
-    output.append("| Metric | Value |")
-    output.append("|--------|-------|")
-    output.append(f"| **Distance** | {summary.get('total_distance', '—')} |")
-    output.append(f"| **Duration** | {summary.get('total_duration', '—')} |")
+    extend(("---", "## 📊 WORKOUT SUMMARY", "", "| Metric | Value |", "|--------|-------|"))
+    add(f"| **Distance** | {summary.get('total_distance', '—')} |")
+    add(f"| **Duration** | {summary.get('total_duration', '—')} |")
     
     if is_swimming:
-        output.append(f"| **Active Time** | {summary.get('active_time', '—')} |")
-        output.append(f"| **Avg Pace** | {summary.get('overall_swim_pace', '—')}/100m |")
+        add(f"| **Active Time** | {summary.get('active_time', '—')} |")
+        add(f"| **Avg Pace** | {summary.get('overall_swim_pace', '—')}/100m |")
         if summary.get('num_lengths'):
-            output.append(f"| **Lengths** | {summary['num_lengths']} |")
+            add(f"| **Lengths** | {summary['num_lengths']} |")
         if summary.get('total_strokes'):
-            output.append(f"| **Total Strokes** | {summary['total_strokes']} |")
+            add(f"| **Total Strokes** | {summary['total_strokes']} |")
     elif is_cycling:
-        output.append(f"| **Avg Speed** | {summary.get('overall_speed', '—')} km/h |")
+        add(f"| **Avg Speed** | {summary.get('overall_speed', '—')} km/h |")
     else:
-        output.append(f"| **Avg Pace** | {summary.get('overall_pace', '—')}/km |")
+        add(f"| **Avg Pace** | {summary.get('overall_pace', '—')}/km |")
     
     if summary.get('avg_hr'):
-        output.append(f"| **Avg HR** | {summary['avg_hr']} bpm |")
+        add(f"| **Avg HR** | {summary['avg_hr']} bpm |")
     if summary.get('max_hr'):
-        output.append(f"| **Max HR** | {summary['max_hr']} bpm |")
+        add(f"| **Max HR** | {summary['max_hr']} bpm |")
     if summary.get('avg_power'):
-        output.append(f"| **Avg Power** | {summary['avg_power']} W |")
+        add(f"| **Avg Power** | {summary['avg_power']} W |")
     if is_cycling and summary.get('normalized_power'):
-        output.append(f"| **Normalized Power** | {summary['normalized_power']} W |")
+        add(f"| **Normalized Power** | {summary['normalized_power']} W |")
     if is_cycling and summary.get('intensity_factor'):
-        output.append(f"| **Intensity Factor** | {summary['intensity_factor']:.2f} |")
+        add(f"| **Intensity Factor** | {summary['intensity_factor']:.2f} |")
     if is_cycling and summary.get('tss'):
-        output.append(f"| **TSS** | {summary['tss']:.1f} |")
+        add(f"| **TSS** | {summary['tss']:.1f} |")
     if is_cycling and summary.get('left_balance'):
         left = summary['left_balance']
         right = round(100 - left, 1)
-        output.append(f"| **L/R Balance** | L {left}% / R {right}% |")
+        add(f"| **L/R Balance** | L {left}% / R {right}% |")
     if summary.get('avg_cadence'):
         unit = "rpm" if is_cycling else ("spm" if is_swimming else "spm")
-        output.append(f"| **Avg Cadence** | {summary['avg_cadence']} {unit} |")
+        add(f"| **Avg Cadence** | {summary['avg_cadence']} {unit} |")
 
     if summary.get('calories'):
-        output.append(f"| **Calories** | {summary['calories']} kcal |")
+        add(f"| **Calories** | {summary['calories']} kcal |")
     if summary.get('training_effect'):
-        output.append(f"| **Training Effect** | {summary['training_effect']:.1f} |")
+        add(f"| **Training Effect** | {summary['training_effect']:.1f} |")
     if summary.get('vo2_max'):
-        output.append(f"| **VO2 Max** | {summary['vo2_max']} ml/kg/min |")
+        add(f"| **VO2 Max** | {summary['vo2_max']} ml/kg/min |")
     
     return "\n".join(output)
 
 
 def format_planned_label(p: Dict, sport: str) -> str:
     """Format a short label for planned interval."""
+    return _format_planned_label_cached(
+        p['type'], p.get('target_distance_m'), p.get('duration_seconds'), p.get('swim_stroke'))
+
+
+@functools.lru_cache(maxsize=256)
+def _format_planned_label_cached(interval_type: str, dist, duration, swim_stroke) -> str:
     parts = []
     
-    if p.get('target_distance_m'):
-        dist = p['target_distance_m']
+    if dist:
         if dist >= 1000:
             parts.append(f"{dist/1000:.1f}km")
         else:
             parts.append(f"{int(dist)}m")
-    elif p.get('duration_seconds'):
-        parts.append(format_planned_duration(p['duration_seconds']))
+    elif duration:
+        parts.append(format_planned_duration(duration))
     
-    if p.get('swim_stroke'):
-        parts.append(p['swim_stroke'])
-    elif p['type'] == 'RECOVERY':
+    if swim_stroke:
+        parts.append(swim_stroke)
+    elif interval_type == 'RECOVERY':
         parts.append("Rest")
     else:
-        parts.append("Hard" if p['type'] == 'WORK' else p['type'].title())
+        parts.append("Hard" if interval_type == 'WORK' else interval_type.title())
     
     return " ".join(parts)
 
@@ -1157,39 +1317,48 @@ def format_planned_duration(seconds: int) -> str:
 
 def format_planned_interval(p: Dict, sport: str) -> str:
     """Format a planned interval line."""
+    # Repeated rounds share the same planned fields, so the line is cached on them
+    return _format_planned_interval_cached(
+        (p['type'], p.get('target_distance_m'), p.get('duration_seconds', 0), p.get('swim_stroke'),
+         p.get('intensity_range'), p.get('pace_range'), p.get('power_range')),
+        sport,
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _format_planned_interval_cached(key: Tuple, sport: str) -> str:
+    interval_type, dist, duration, swim_stroke, intensity_range, pace_range, power_range = key
     parts = []
     
     # Duration or distance
-    if p.get('target_distance_m'):
-        dist = p['target_distance_m']
+    if dist:
         if dist >= 1000:
             parts.append(f"{dist/1000:.2f}km")
         else:
             parts.append(f"{int(dist)}m")
-    elif p.get('duration_seconds'):
-        parts.append(format_planned_duration(p['duration_seconds']))
+    elif duration:
+        parts.append(format_planned_duration(duration))
     
     # Stroke type for swimming
-    if p.get('swim_stroke'):
-        parts.append(p['swim_stroke'])
+    if swim_stroke:
+        parts.append(swim_stroke)
     else:
-        interval_type = p['type']
         if interval_type == 'WORK':
             parts.append("Hard")
         elif interval_type == 'RECOVERY':
-            parts.append("Rest" if p.get('duration_seconds', 0) < 60 else "Easy")
+            parts.append("Rest" if duration < 60 else "Easy")
         else:
             parts.append(interval_type.title())
     
     # Target
-    if p.get('intensity_range'):
-        parts.append(f"@ {p['intensity_range']}")
+    if intensity_range:
+        parts.append(f"@ {intensity_range}")
     
-    if p.get('pace_range'):
+    if pace_range:
         unit = "/100m" if sport == 'swimming' else "/km"
-        parts.append(f"({p['pace_range']}{unit})")
-    elif p.get('power_range'):
-        parts.append(f"({p['power_range']})")
+        parts.append(f"({pace_range}{unit})")
+    elif power_range:
+        parts.append(f"({power_range})")
     
     return "- " + " ".join(parts)
 
@@ -1239,10 +1408,180 @@ def format_combined_lap(combined: Dict, sport: str) -> str:
     return " | ".join(parts)
 
 
+# Optional summary rows of the no-plan report: (summary key, label, unit)
+REPORT_SUMMARY_ROWS = (
+    ('avg_hr', 'Avg HR', 'bpm'),
+    ('max_hr', 'Max HR', 'bpm'),
+    ('avg_power', 'Avg Power', 'W'),
+    ('calories', 'Calories', 'kcal'),
+)
+
+
+def format_report_lap(i: int, lap: Dict) -> str:
+    """Format one running/cycling lap line for the report generated without a workout plan."""
+    get = lap.get
+    avg_hr, cadence = get('avg_hr'), get('cadence')
+    mins, secs = divmod(int(get('duration_seconds', 0)), 60)
+    
+    line = f"**Lap {i}:** **{mins}:{secs:02d}** — {get('avg_pace') or '--:--'}/km"
+    if avg_hr:
+        line += f" | HR {avg_hr}"
+    if cadence:
+        line += f" | Cad {cadence} spm"
+    return line + "  "
+
+
+def format_swim_report_lap(i: int, lap: Dict) -> str:
+    """Format one swim set line for the report generated without a workout plan."""
+    get = lap.get
+    avg_hr, swolf, strokes, dps, stroke = (
+        get('avg_hr'), get('swolf'), get('total_strokes'), get('dps'), get('swim_stroke'))
+    mins, secs = divmod(int(get('duration_seconds', 0)), 60)
+    dist_m = get('distance_m', 0)
+    distance = f"{dist_m/1000:.2f}km" if dist_m >= 1000 else f"{int(dist_m)}m"
+    
+    line = (f"**{get('set_description') or f'Set {i}'}:** **{distance}** in {mins}:{secs:02d}"
+            f" | Pace {get('swim_pace') or '--:--'}/100m")
+    if avg_hr:
+        line += f" | HR {avg_hr} avg"
+    if swolf:
+        line += f" | SWOLF {swolf}"
+    if strokes:
+        line += f" | Strokes {strokes}"
+    if dps:
+        line += f" | DPS {dps:.2f}"
+    if stroke and stroke != 'REST':
+        line += f" | ({STROKE_NAMES.get(stroke, stroke)})"
+    return line + "  "
+
+
 # =============================================================================
 # STREAMLIT UI
 # =============================================================================
 
+# Streamlit reruns the whole script on every widget interaction. Uploads are
+# parsed once per distinct file content (kept in memory, never on disk) and
+# the processed laps are reused on later reruns.
+
+@st.cache_data(show_spinner=False)
+def load_form_laps(file_bytes: bytes) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
+    """Parse a FORM CSV upload and process its lengths into sets."""
+    import io
+    
+    raw_lengths, session_info = load_form_csv(io.BytesIO(file_bytes))
+    if not (raw_lengths and session_info):
+        return None, None
+    return process_form_lengths(raw_lengths, session_info), session_info
+
+
+@st.cache_data(show_spinner=False)
+def load_fit_laps(file_bytes: bytes) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
+    """Parse a FIT upload and process its laps for the detected sport."""
+    import io
+    
+    _, raw_laps, session_info = load_fit_file(io.BytesIO(file_bytes))
+    if not (raw_laps and session_info):
+        return None, None
+    session_data = extract_session_info(session_info)
+    laps = process_fit_laps(raw_laps, sport=session_data['sport'], min_duration=3)
+    return laps, session_data
+
+
+@st.fragment
+def render_report():
+    """Render the Generate Report button and the report it produces.
+    
+    Runs as a fragment, so clicking the button reruns only this section
+    rather than the plan editor and upload parsing above it.
+    """
+    if st.button("🔄 Generate Report", type="primary"):
+        if 'actual_laps' not in st.session_state:
+            st.error("Upload a FIT file first!")
+        else:
+            session_data = st.session_state.get('session_info', {})
+            sport = session_data.get('sport', 'running')
+            processed_laps = st.session_state['actual_laps']
+            
+            # Check if plan was provided
+            has_plan = 'planned_blocks' in st.session_state and st.session_state['planned_blocks']
+            
+            # Regenerating with the same file and plan reuses the last report
+            report_key = (
+                st.session_state.get('laps_file_id'),
+                st.session_state.get('parsed_plan_text') if has_plan else None,
+            )
+            
+            if not has_plan:
+                st.info("ℹ️ No workout plan provided. Generating lap-by-lap summary.")
+            
+            if st.session_state.get('report_key') == report_key:
+                output = st.session_state['report']
+            elif has_plan:
+                # Compare against planned workout
+                grouped = group_laps_by_planned(
+                    st.session_state['planned_blocks'],
+                    processed_laps,
+                    sport=sport
+                )
+                
+                summary = calculate_overall_summary(processed_laps, session_data)
+                
+                output = generate_detailed_output(
+                    st.session_state['planned_blocks'],
+                    st.session_state.get('num_rounds', 0),
+                    grouped,
+                    summary,
+                    session_data
+                )
+            else:
+                # No plan - generate simple lap report
+                summary = calculate_overall_summary(processed_laps, session_data)
+                
+                # Build simple report
+                emoji = SPORT_EMOJI.get(sport, "🏃")
+                activity_name = session_data.get('activity_name', 'Activity')
+                
+                lines = []
+                lines.append(f"# {emoji} {sport.upper()}: {activity_name}")
+                lines.append("")
+                
+                start_time = session_data.get('start_time')
+                if start_time:
+                    lines.append(f"**Date:** {start_time}")
+                lines.append("")
+                
+                # Summary table
+                lines.append("## 📊 Summary")
+                lines.append("| Metric | Value |")
+                lines.append("|--------|-------|")
+                lines.append(f"| **Duration** | {summary.get('total_duration', '—')} |")
+                lines.append(f"| **Distance** | {summary.get('total_distance', '—')} |")
+                lines.extend(
+                    f"| **{label}** | {value} {unit} |"
+                    for key, label, unit in REPORT_SUMMARY_ROWS
+                    if (value := summary.get(key))
+                )
+                lines.append("")
+                
+                # Laps - use inline format like default workout reports
+                lines.append("## 🔄 Sets")
+                lines.append("")
+                
+                # Each lap line is followed by a blank line
+                format_lap = format_swim_report_lap if sport == 'swimming' else format_report_lap
+                lines.extend(f"{format_lap(i, lap)}\n" for i, lap in enumerate(processed_laps, 1))
+                
+                lines.append("---")
+                lines.append("*Report generated without a workout plan.*")
+                
+                output = "\n".join(lines)
+            
+            st.session_state['report_key'] = report_key
+            st.session_state['report'] = output
+            st.markdown(output)
+            st.download_button("📥 Download Report", output, "workout_report.md", "text/markdown")
+
+
 def main():
     st.set_page_config(
         page_title="Interval Matcher",
@@ -1280,9 +1619,14 @@ Cool Down 5m 80-89% Pace"""
         plan_text = st.text_area("Paste your workout plan:", value=default_plan, height=220)
         
         if st.button("Parse Plan", type="primary"):
-            planned_blocks, num_rounds = parse_plan_text(plan_text)
-            st.session_state['planned_blocks'] = planned_blocks
-            st.session_state['num_rounds'] = num_rounds
+            # Re-clicking with an unchanged plan keeps the blocks already parsed
+            if st.session_state.get('parsed_plan_text') == plan_text and 'planned_blocks' in st.session_state:
+                planned_blocks = st.session_state['planned_blocks']
+            else:
+                planned_blocks, num_rounds = parse_plan_text(plan_text)
+                st.session_state['planned_blocks'] = planned_blocks
+                st.session_state['num_rounds'] = num_rounds
+                st.session_state['parsed_plan_text'] = plan_text
             if planned_blocks:
                 st.success(f"✅ Parsed {len(planned_blocks)} intervals")
     
@@ -1297,17 +1641,18 @@ Cool Down 5m 80-89% Pace"""
         
         if uploaded_file:
             file_name = uploaded_file.name.lower()
+            file_bytes = uploaded_file.getvalue()
             
             if file_name.endswith('.csv'):
                 # FORM goggles CSV
                 with st.spinner("Parsing FORM CSV file..."):
-                    raw_lengths, session_info = load_form_csv(uploaded_file)
+                    laps, session_info = load_form_laps(file_bytes)
                 
-                if raw_lengths and session_info:
-                    laps = process_form_lengths(raw_lengths, session_info)
+                if laps is not None and session_info:
                     st.session_state['actual_laps'] = laps
                     st.session_state['session_info'] = session_info
                     st.session_state['file_type'] = 'FORM'
+                    st.session_state['laps_file_id'] = uploaded_file.file_id
                     
                     pool_size = session_info.get('pool_length', 25)
                     st.success(f"✅ 🏊 **FORM Swim** — {len(laps)} sets, {pool_size}m pool")
@@ -1315,150 +1660,21 @@ Cool Down 5m 80-89% Pace"""
             else:
                 # FIT file
                 with st.spinner("Parsing FIT file..."):
-                    df, raw_laps, session_info = load_fit_file(uploaded_file)
+                    laps, session_data = load_fit_laps(file_bytes)
                 
-                if raw_laps and session_info:
-                    session_data = extract_session_info(session_info)
+                if laps is not None and session_data:
                     sport = session_data['sport']
-                    laps = process_fit_laps(raw_laps, sport=sport, min_duration=3)
                     st.session_state['actual_laps'] = laps
                     st.session_state['session_info'] = session_data
                     st.session_state['file_type'] = 'FIT'
+                    st.session_state['laps_file_id'] = uploaded_file.file_id
                     
-                    emoji = "🏊" if sport == 'swimming' else ("🚴" if sport == 'cycling' else "🏃")
+                    emoji = SPORT_EMOJI.get(sport, "🏃")
                     st.success(f"✅ {emoji} **{session_data['activity_name']}** — {len(laps)} laps")
     
     st.markdown("---")
     
-    if st.button("🔄 Generate Report", type="primary"):
-        if 'actual_laps' not in st.session_state:
-            st.error("Upload a FIT file first!")
-        else:
-            session_data = st.session_state.get('session_info', {})
-            sport = session_data.get('sport', 'running')
-            processed_laps = st.session_state['actual_laps']
-            
-            # Check if plan was provided
-            has_plan = 'planned_blocks' in st.session_state and st.session_state['planned_blocks']
-            
-            if has_plan:
-                # Compare against planned workout
-                grouped = group_laps_by_planned(
-                    st.session_state['planned_blocks'],
-                    processed_laps,
-                    sport=sport
-                )
-                
-                summary = calculate_overall_summary(processed_laps, session_data)
-                
-                output = generate_detailed_output(
-                    st.session_state['planned_blocks'],
-                    st.session_state.get('num_rounds', 0),
-                    grouped,
-                    summary,
-                    session_data
-                )
-            else:
-                # No plan - generate simple lap report
-                st.info("ℹ️ No workout plan provided. Generating lap-by-lap summary.")
-                
-                summary = calculate_overall_summary(processed_laps, session_data)
-                
-                # Build simple report
-                emoji = "🏊" if sport == 'swimming' else ("🚴" if sport == 'cycling' else "🏃")
-                activity_name = session_data.get('activity_name', 'Activity')
-                
-                lines = []
-                lines.append(f"# {emoji} {sport.upper()}: {activity_name}")
-                lines.append("")
-                
-                start_time = session_data.get('start_time')
-                if start_time:
-                    lines.append(f"**Date:** {start_time}")
-                lines.append("")
-                
-                # Summary table
-                lines.append("## 📊 Summary")
-                lines.append("| Metric | Value |")
-                lines.append("|--------|-------|")
-                lines.append(f"| **Duration** | {summary.get('total_duration', '—')} |")
-                lines.append(f"| **Distance** | {summary.get('total_distance', '—')} |")
-                if summary.get('avg_hr'):
-                    lines.append(f"| **Avg HR** | {summary['avg_hr']} bpm |")
-                if summary.get('max_hr'):
-                    lines.append(f"| **Max HR** | {summary['max_hr']} bpm |")
-                if summary.get('avg_power'):
-                    lines.append(f"| **Avg Power** | {summary['avg_power']} W |")
-                if summary.get('calories'):
-                    lines.append(f"| **Calories** | {summary['calories']} kcal |")
-                lines.append("")
-                
-                # Laps - use inline format like default workout reports
-                lines.append("## 🔄 Sets")
-                lines.append("")
-                
-                for i, lap in enumerate(processed_laps, 1):
-                    dur_sec = lap.get('duration_seconds', 0)
-                    mins, secs = divmod(int(dur_sec), 60)
-                    duration = f"{mins}:{secs:02d}"
-                    
-                    dist_m = lap.get('distance_m', 0)
-                    if dist_m >= 1000:
-                        distance = f"{dist_m/1000:.2f}km"
-                    else:
-                        distance = f"{int(dist_m)}m"
-                    
-                    # Build inline format like format_combined_lap
-                    parts = []
-                    
-                    if sport == 'swimming':
-                        set_desc = lap.get('set_description') or f"Set {i}"
-                        pace = lap.get('swim_pace') or '--:--'
-                        parts.append(f"**{distance}** in {duration}")
-                        parts.append(f"Pace {pace}/100m")
-                        
-                        # HR
-                        if lap.get('avg_hr'):
-                            parts.append(f"HR {lap['avg_hr']} avg")
-                        
-                        # SWOLF
-                        if lap.get('swolf'):
-                            parts.append(f"SWOLF {lap['swolf']}")
-                        
-                        # Strokes
-                        if lap.get('total_strokes'):
-                            parts.append(f"Strokes {lap['total_strokes']}")
-                        
-                        # DPS
-                        if lap.get('dps'):
-                            parts.append(f"DPS {lap['dps']:.2f}")
-                        
-                        # Stroke type
-                        if lap.get('swim_stroke') and lap['swim_stroke'] != 'REST':
-                            stroke_name = {'FR': 'Free', 'BR': 'Breast', 'BA': 'Back', 'FL': 'Fly'}.get(lap['swim_stroke'], lap['swim_stroke'])
-                            parts.append(f"({stroke_name})")
-                        
-                        lines.append(f"**{set_desc}:** " + " | ".join(parts) + "  ")
-                    else:
-                        # Non-swimming format
-                        hr = lap.get('avg_hr') or '—'
-                        pace = lap.get('avg_pace') or '--:--'
-                        parts.append(f"**{duration}** — {pace}/km")
-                        if lap.get('avg_hr'):
-                            parts.append(f"HR {lap['avg_hr']}")
-                        if lap.get('cadence'):
-                            parts.append(f"Cad {lap['cadence']} spm")
-                        lines.append(f"**Lap {i}:** " + " | ".join(parts) + "  ")
-                    
-                    lines.append("")
-                
-                lines.append("---")
-                lines.append("*Report generated without a workout plan.*")
-                
-                output = "\n".join(lines)
-            
-            st.markdown(output)
-            st.download_button("📥 Download Report", output, "workout_report.md", "text/markdown")
+    render_report()
 
 
 if __name__ == "__main__":
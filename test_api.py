@@ -5,29 +5,114 @@ Tests for the Ephemeral Workout Analyzer API
 import pytest
 from fastapi.testclient import TestClient
 import io
+import os
+import signal
+from collections import OrderedDict
+import struct
+import asyncio
+from fastapi import HTTPException, UploadFile
 
 # Import the app
-from api import app, parse_fit_bytes
+import api
+from api import (
+    app, parse_fit_bytes, parse_form_csv_bytes, read_upload_capped,
+    result_cache_key, _result_cache, is_fit_file,
+)
 
-client = TestClient(app)
+@pytest.fixture(scope="module")
+def client():
+    """One TestClient per module, so app startup and shutdown run once."""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+# FIT CRC-16 nibble table (from the FIT SDK)
+_FIT_CRC_TABLE = [
+    0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+    0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400,
+]
+_FIT_BASE_TYPES = {0x00: 'B', 0x02: 'B', 0x84: 'H', 0x86: 'I'}
+
+
+def _fit_crc(data: bytes, crc: int = 0) -> int:
+    for byte in data:
+        tmp = _FIT_CRC_TABLE[crc & 0xF]
+        crc = ((crc >> 4) & 0x0FFF) ^ tmp ^ _FIT_CRC_TABLE[byte & 0xF]
+        tmp = _FIT_CRC_TABLE[crc & 0xF]
+        crc = ((crc >> 4) & 0x0FFF) ^ tmp ^ _FIT_CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+
+def build_fit(messages) -> bytes:
+    """Build a minimal FIT file from (global_mesg_num, [(field_num, base_type, value)])."""
+    body = b''
+    for local, (mesg_num, fields) in enumerate(messages):
+        local %= 16
+        body += struct.pack('<BBBHB', 0x40 | local, 0, 0, mesg_num, len(fields))
+        for num, base_type, _ in fields:
+            body += struct.pack('<BBB', num, struct.calcsize(_FIT_BASE_TYPES[base_type]), base_type)
+        body += bytes([local])
+        body += b''.join(struct.pack('<' + _FIT_BASE_TYPES[bt], v) for _, bt, v in fields)
+    header = struct.pack('<BBHI4s', 14, 0x10, 2093, len(body), b'.FIT')
+    header += struct.pack('<H', _fit_crc(header))
+    data = header + body
+    return data + struct.pack('<H', _fit_crc(data))
+
+
+def sample_run_fit(num_laps: int = 3) -> bytes:
+    """A running activity with 5-minute 1km laps, a session and a VO2 max message."""
+    start = 1000000000
+    messages = [(0, [(0, 0x00, 4)])]  # file_id: activity
+    for i in range(num_laps):
+        messages.append((20, [(253, 0x86, start + 300 * i), (3, 0x02, 150)]))  # record
+        messages.append((19, [  # lap
+            (2, 0x86, start + 300 * i),   # start_time
+            (7, 0x86, 300000),            # total_elapsed_time (ms)
+            (9, 0x86, 100000),            # total_distance (cm)
+            (13, 0x84, 3333),             # avg_speed (mm/s)
+            (15, 0x02, 150 + i),          # avg_heart_rate
+            (16, 0x02, 160 + i),          # max_heart_rate
+        ]))
+    messages.append((18, [  # session
+        (2, 0x86, start),
+        (5, 0x00, 1),                     # sport: running
+        (7, 0x86, 300000 * num_laps),
+        (9, 0x86, 100000 * num_laps),
+        (16, 0x02, 151),
+        (11, 0x84, 500),                  # total_calories
+    ]))
+    messages.append((140, [(29, 0x86, 936235)]))  # VO2 max developer data
+    return build_fit(messages)
+
+
+SAMPLE_FORM_CSV = b"""Swim Title,Swim Date,Swim Start Time,Pool Size,Pool Units
+Morning Swim,2024-01-15,07:30:00,25,m
+
+Set #,Set,Interval (m),Length (m),Strk,Move Time,Rest Time,Cumul Time,Cumul Dist (m),Avg DPS,Avg BPM (moving),Max BPM,Min BPM (resting),Pace/100,Pace/50,SWOLF,Avg Strk Rate (strk/min),Strk Count,Calories
+1,50 FR Warmup,50,25,FR,0:25.50,0:00.00,0:25.50,25,1.40,120,125,0,1:42.00,0:51.00,43,30,18,5
+1,50 FR Warmup,50,25,FR,0:26.50,0:00.00,0:52.00,50,1.35,126,132,0,1:46.00,0:53.00,47,31,20,5
+1,50 FR Warmup,0,0,REST,0:00.00,0:30.00,1:22.00,50,0,0,0,110,0:00.00,0:00.00,0,0,0,1
+2,50 BR Drill,50,25,BR,0:35.00,0:00.00,1:57.00,75,1.10,,,0,2:20.00,1:10.00,55,25,20,6
+2,50 BR Drill,50,25,BR,0:36.00,0:00.00,2:33.00,100,1.05,,,0,2:24.00,1:12.00,57,25,21,6
+"""
 
 
 class TestHealthEndpoint:
     """Test the health check endpoint."""
     
-    def test_health_returns_200(self):
+    def test_health_returns_200(self, client):
         """Health endpoint should return 200 OK."""
         response = client.get("/health")
         assert response.status_code == 200
     
-    def test_health_returns_healthy_status(self):
+    def test_health_returns_healthy_status(self, client):
         """Health endpoint should indicate healthy status."""
         response = client.get("/health")
         data = response.json()
         assert data["status"] == "healthy"
         assert data["ephemeral"] == True
     
-    def test_health_includes_version(self):
+    def test_health_includes_version(self, client):
         """Health endpoint should include version."""
         response = client.get("/health")
         data = response.json()
@@ -37,12 +122,12 @@ class TestHealthEndpoint:
 class TestTiersEndpoint:
     """Test the pricing tiers endpoint."""
     
-    def test_tiers_returns_200(self):
+    def test_tiers_returns_200(self, client):
         """Tiers endpoint should return 200 OK."""
         response = client.get("/tiers")
         assert response.status_code == 200
     
-    def test_tiers_returns_three_tiers(self):
+    def test_tiers_returns_three_tiers(self, client):
         """Should return Free, Pro, and Elite tiers."""
         response = client.get("/tiers")
         data = response.json()
@@ -56,7 +141,7 @@ class TestTiersEndpoint:
 class TestValidateKeyEndpoint:
     """Test API key validation."""
     
-    def test_anonymous_access_allowed(self):
+    def test_anonymous_access_allowed(self, client):
         """Anonymous access should be allowed with free tier."""
         response = client.get("/validate-key")
         assert response.status_code == 200
@@ -64,45 +149,180 @@ class TestValidateKeyEndpoint:
         assert data["tier"] == "anonymous"
         assert data["daily_limit"] == 3
     
-    def test_valid_free_key(self):
-        """Valid free key should return free tier info."""
-        response = client.get("/validate-key", headers={"X-API-Key": "demo-free-key"})
+    @pytest.mark.parametrize("api_key, tier, daily_limit", [
+        ("demo-free-key", "free", 3),
+        ("demo-pro-key", "pro", 50),
+        ("demo-elite-key", "elite", 1000),
+    ])
+    def test_valid_key(self, client, api_key, tier, daily_limit):
+        """Valid keys should return their tier info."""
+        response = client.get("/validate-key", headers={"X-API-Key": api_key})
         assert response.status_code == 200
         data = response.json()
-        assert data["tier"] == "free"
-        assert data["daily_limit"] == 3
+        assert data["tier"] == tier
+        assert data["daily_limit"] == daily_limit
     
-    def test_valid_pro_key(self):
-        """Valid pro key should return pro tier info."""
-        response = client.get("/validate-key", headers={"X-API-Key": "demo-pro-key"})
-        assert response.status_code == 200
-        data = response.json()
-        assert data["tier"] == "pro"
-        assert data["daily_limit"] == 50
-    
-    def test_valid_elite_key(self):
-        """Valid elite key should return elite tier info."""
-        response = client.get("/validate-key", headers={"X-API-Key": "demo-elite-key"})
-        assert response.status_code == 200
-        data = response.json()
-        assert data["tier"] == "elite"
-        assert data["daily_limit"] == 1000
-    
-    def test_invalid_key_rejected(self):
+    def test_invalid_key_rejected(self, client):
         """Invalid API key should be rejected."""
         response = client.get("/validate-key", headers={"X-API-Key": "invalid-key"})
         assert response.status_code == 401
 
 
+class TestParseFitBytes:
+    """Test in-memory FIT parsing."""
+    
+    def test_extracts_laps(self):
+        """Every lap message should be returned as a dict."""
+        laps, _ = parse_fit_bytes(sample_run_fit(num_laps=3))
+        assert len(laps) == 3
+        assert laps[0]['total_distance'] == 1000.0
+        assert laps[2]['avg_heart_rate'] == 152
+    
+    def test_extracts_session_and_vo2_max(self):
+        """Session fields and the developer VO2 max should be merged."""
+        _, session_info = parse_fit_bytes(sample_run_fit())
+        assert session_info['sport'] == 'running'
+        assert session_info['total_calories'] == 500
+        assert session_info['vo2_max'] == 50.0
+    
+    def test_detects_fit_signature(self):
+        """FIT files are recognised by their header, CSVs are not."""
+        assert is_fit_file(sample_run_fit())
+        assert not is_fit_file(SAMPLE_FORM_CSV)
+        assert not is_fit_file(b".FIT")
+
+
+class TestParseFormCsvBytes:
+    """Test FORM goggles CSV parsing."""
+    
+    def test_reads_session_header(self):
+        """The two header rows should become session info."""
+        _, session_info = parse_form_csv_bytes(SAMPLE_FORM_CSV)
+        assert session_info['activity_name'] == 'Morning Swim'
+        assert session_info['pool_length'] == 25
+        assert session_info['start_time'] == '2024-01-15 07:30:00'
+    
+    def test_combines_lengths_by_set(self):
+        """Consecutive lengths of the same set should be combined into one lap."""
+        laps, _ = parse_form_csv_bytes(SAMPLE_FORM_CSV)
+        assert len(laps) == 2
+        warmup, drill = laps
+        assert warmup['distance_m'] == 50
+        assert warmup['duration_seconds'] == 82.0
+        assert warmup['num_lengths'] == 2
+        assert warmup['avg_hr'] == 123
+        assert warmup['max_hr'] == 132
+        assert warmup['swolf'] == 45
+        assert warmup['total_strokes'] == 38
+        assert warmup['calories'] == 11
+        assert warmup['swim_pace'] == '1:44'
+        assert drill['avg_hr'] is None
+        assert drill['swim_stroke'] == 'BR'
+    
+    def test_quoted_commas(self):
+        """Quoted titles and set descriptions may contain commas."""
+        csv_bytes = (
+            b'Swim Title,Pool Size\n"Swim, easy",25\n\n'
+            b'Set #,Set,Length (m),Strk,Move Time\n1,"100, pull",25,FR,0:30.00\n'
+        )
+        laps, session_info = parse_form_csv_bytes(csv_bytes)
+        assert session_info['activity_name'] == 'Swim, easy'
+        assert laps[0]['set_description'] == '100, pull'
+    
+    def test_trailing_comma_keeps_columns_aligned(self):
+        """Rows with more fields than the header should not shift the columns."""
+        csv_bytes = (
+            b'Swim Title,Pool Size\nSwim,25\n\n'
+            b'Set #,Set,Length (m),Strk,Move Time\n1,100 FR,25,FR,0:30.00,\n1,100 FR,25,FR,0:31.00,\n'
+        )
+        laps, _ = parse_form_csv_bytes(csv_bytes)
+        assert len(laps) == 1
+        assert laps[0]['lap_number'] == 1
+        assert laps[0]['set_description'] == '100 FR'
+        assert laps[0]['swim_stroke'] == 'FR'
+        assert laps[0]['distance_m'] == 50
+        assert laps[0]['is_rest'] is False
+    
+    def test_short_rows_are_skipped(self):
+        """Rows with fewer fields than the header should not count as lengths."""
+        csv_bytes = (
+            b'Swim Title,Pool Size\nSwim,25\n\n'
+            b'Set #,Set,Length (m),Strk,Move Time\n1,100 FR,25,FR,0:30.00\n1,100 FR,25,FR\n'
+        )
+        laps, _ = parse_form_csv_bytes(csv_bytes)
+        assert laps[0]['distance_m'] == 25
+        assert laps[0]['num_lengths'] == 1
+        assert laps[0]['swim_pace'] == '2:00'
+    
+    def test_malformed_time_only_zeroes_its_row(self):
+        """One time cell that is neither M:SS nor H:MM:SS should not wipe the others."""
+        csv_bytes = (
+            b'Swim Title,Pool Size\nSwim,25\n\n'
+            b'Set #,Set,Length (m),Strk,Move Time\n'
+            b'1,A,25,FR,0:30.00\n2,B,25,FR,1:00:31.00\n3,C,25,FR,1:2:3:4\n'
+        )
+        laps, _ = parse_form_csv_bytes(csv_bytes)
+        assert [lap['duration_seconds'] for lap in laps] == [30.0, 3631.0, 0.0]
+    
+    def test_blank_length_is_not_rest(self):
+        """Only an explicit zero length marks rest; a blank length still counts toward HR."""
+        csv_bytes = (
+            b'Swim Title,Pool Size\nSwim,25\n\n'
+            b'Set #,Set,Length (m),Strk,Move Time,Avg BPM (moving)\n'
+            b'1,A,25,FR,0:30.00,140\n1,A,,FR,0:30.00,150\n'
+        )
+        laps, _ = parse_form_csv_bytes(csv_bytes)
+        assert laps[0]['avg_hr'] == 145
+        assert laps[0]['num_lengths'] == 2
+        assert laps[0]['distance_m'] == 25
+    
+    def test_invalid_csv_returns_none(self):
+        """Unparseable content should not raise."""
+        assert parse_form_csv_bytes(b"\xff\xfe not utf-8") == (None, None)
+
+
+class TestReadUploadCapped:
+    """Test chunked upload reading."""
+    
+    def test_reads_whole_file_under_cap(self):
+        """Files under the cap should be returned intact."""
+        upload = UploadFile(io.BytesIO(b"x" * 5000))
+        assert asyncio.run(read_upload_capped(upload, cap=5000)) == b"x" * 5000
+    
+    def test_unknown_size_returns_bytes(self):
+        """The chunked path for uploads without a known size should return bytes."""
+        upload = UploadFile(io.BytesIO(b"x" * 5000))
+        assert upload.size is None
+        result = asyncio.run(read_upload_capped(upload, cap=5000))
+        assert isinstance(result, bytes)
+        assert result == b"x" * 5000
+    
+    def test_rejects_file_over_cap(self):
+        """Files over the cap should be rejected with 413."""
+        upload = UploadFile(io.BytesIO(b"x" * 5001))
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(read_upload_capped(upload, cap=5000))
+        assert exc_info.value.status_code == 413
+    
+    def test_rejects_declared_size_over_cap_without_reading(self):
+        """Uploads with a known size over the cap should be rejected unread."""
+        data = io.BytesIO(b"x" * 5001)
+        upload = UploadFile(data, size=5001)
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(read_upload_capped(upload, cap=5000))
+        assert exc_info.value.status_code == 413
+        assert data.tell() == 0
+
+
 class TestAnalyzeEndpoint:
     """Test the main analyze endpoint."""
     
-    def test_missing_file_returns_422(self):
+    def test_missing_file_returns_422(self, client):
         """Missing file should return 422."""
         response = client.post("/analyze", data={"plan": "test plan"})
         assert response.status_code == 422
     
-    def test_missing_plan_is_allowed(self):
+    def test_missing_plan_is_allowed(self, client):
         """Missing plan should NOT return 422 (plan is optional)."""
         # Request without plan should proceed to FIT parsing (may fail on invalid FIT)
         fake_fit = io.BytesIO(b"fake fit data")
@@ -113,12 +333,107 @@ class TestAnalyzeEndpoint:
         # Should NOT be 422 (validation error for missing required field)
         # Will likely be 400 (FIT parse error) or 200 (if valid FIT)
         assert response.status_code != 422
+    
+    def test_fit_upload_without_plan(self, client):
+        """A valid FIT upload should produce one grouped entry per lap."""
+        response = client.post(
+            "/analyze",
+            files={"file": ("run.fit", io.BytesIO(sample_run_fit(num_laps=3)), "application/octet-stream")}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] == True
+        assert data["sport"] == "running"
+        assert len(data["grouped_data"]) == 3
+    
+    def test_fit_with_csv_name_is_parsed_as_fit(self, client):
+        """Routing should follow the FIT header, not the file name."""
+        response = client.post(
+            "/analyze",
+            files={"file": ("renamed.csv", io.BytesIO(sample_run_fit(num_laps=4)), "text/csv")}
+        )
+        assert response.status_code == 200
+        assert response.json()["sport"] == "running"
+    
+    def test_unparseable_csv_returns_400(self, client):
+        """A CSV with no usable lengths should be rejected as unparseable."""
+        response = client.post(
+            "/analyze",
+            files={"file": ("swim.csv", io.BytesIO(b"not,a\nform,export"), "text/csv")}
+        )
+        assert response.status_code == 400
+    
+    def test_repeated_upload_served_from_cache(self, client):
+        """Re-uploading identical bytes should return the cached result."""
+        fit_bytes = sample_run_fit(num_laps=2)
+        files = {"file": ("run.fit", fit_bytes, "application/octet-stream")}
+        first = client.post("/analyze", files=files)
+        key = result_cache_key(fit_bytes, "run.fit", None)
+        assert key in _result_cache
+        second = client.post("/analyze", files=files)
+        assert second.json() == first.json()
+    
+    def test_recovers_after_worker_killed(self, client):
+        """A killed worker process should not break later analyses."""
+        files = {"file": ("run.fit", sample_run_fit(num_laps=6), "application/octet-stream")}
+        no_cache = {"Cache-Control": "no-cache"}
+        assert client.post("/analyze", files=files, headers=no_cache).json()["success"]
+        
+        for process in list(api._process_pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        
+        response = client.post("/analyze", files=files, headers=no_cache)
+        assert response.status_code == 200
+        assert response.json()["success"]
+        assert result_cache_key(files["file"][1], "run.fit", None) not in _result_cache
+    
+    def test_stale_broken_pool_does_not_shut_down_replacement(self, monkeypatch):
+        """Discarding an already-replaced pool should leave the current pool running."""
+        stale, current = api.ProcessPoolExecutor(max_workers=1), api.ProcessPoolExecutor(max_workers=1)
+        monkeypatch.setattr(api, "_process_pool", current)
+        api.shutdown_process_pool(stale)
+        assert api._process_pool is current
+        assert current.submit(abs, -1).result() == 1
+        stale.shutdown()
+        current.shutdown()
+
+
+class TestResultCache:
+    """Test the in-memory result cache bounds."""
+    
+    @pytest.fixture(autouse=True)
+    def empty_cache(self, monkeypatch):
+        monkeypatch.setattr(api, "_result_cache", OrderedDict())
+        monkeypatch.setattr(api, "_result_cache_bytes", 0)
+    
+    def test_expired_results_are_evicted(self, monkeypatch):
+        """Results older than the TTL should be dropped on lookup."""
+        now = 1000.0
+        monkeypatch.setattr(api.time, "monotonic", lambda: now)
+        api.store_cached_result(b"key", b"report")
+        assert api.get_cached_result(b"key") == b"report"
+        now += api.RESULT_CACHE_TTL_SECONDS
+        assert api.get_cached_result(b"key") is None
+        assert api._result_cache_bytes == 0
+    
+    def test_byte_budget_evicts_oldest(self, monkeypatch):
+        """Storing past the byte budget should evict the oldest results first."""
+        monkeypatch.setattr(api, "RESULT_CACHE_MAX_BYTES", 10)
+        api.store_cached_result(b"a", b"1234")
+        api.store_cached_result(b"b", b"1234")
+        api.store_cached_result(b"c", b"1234")
+        assert api.get_cached_result(b"a") is None
+        assert api.get_cached_result(b"c") == b"1234"
+        api.store_cached_result(b"big", b"x" * 11)
+        assert api.get_cached_result(b"big") is None
+        assert api._result_cache_bytes == 8
 
 
 class TestRateLimiting:
     """Test rate limiting functionality."""
     
-    def test_rate_limit_header_present(self):
+    def test_rate_limit_header_present(self, client):
         """Rate limit headers should be present."""
         response = client.get("/health")
         # Check that rate limiting is configured